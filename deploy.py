@@ -7,20 +7,56 @@ Uses Bicep template for Infrastructure-as-Code deployment
 import os
 import sys
 import json
-import subprocess
+import atexit
+import shutil
 from pathlib import Path
 
-def run_command(cmd, check=True):
-    """Run a command and return the result."""
-    print(f"🔧 Running: {cmd}")
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    
-    if check and result.returncode != 0:
-        print(f"❌ Command failed: {cmd}")
-        print(f"Error: {result.stderr}")
-        sys.exit(1)
+from deploy_common import cached_az, deployment_succeeded, ensure_rg, run_deployment
+
+try:
+    import readline  # Line editing and history for input(); not available on plain Windows
+except ImportError:
+    readline = None
+
+HISTORY_FILE = os.path.expanduser("~/.docusense_deploy_history")
+
+def _init_readline():
+    """Load prompt history and save it again on exit."""
+    if readline is None:
+        return
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except OSError:
+        pass
+    readline.set_history_length(500)
+    atexit.register(_save_history)
+
+def _save_history():
+    try:
+        readline.write_history_file(HISTORY_FILE)
+    except OSError:
+        pass
+
+def prompt(label, default="", secret=False):
+    """input() with the default pre-filled so it can be edited in place.
+    
+    Secret answers are dropped from the readline history so they never reach HISTORY_FILE.
+    """
+    if default:
+        if readline is not None:
+            readline.set_startup_hook(lambda: readline.insert_text(default))
+        else:
+            label = f"{label.rstrip(': ')} [{default}]: "
+    try:
+        value = input(label).strip()
+    finally:
+        if readline is not None:
+            readline.set_startup_hook()
+    
+    if secret and readline is not None and value:
+        readline.remove_history_item(readline.get_current_history_length() - 1)
     
-    return result
+    return value or default
 
 def get_required_parameters():
     """Get required parameters for deployment."""
@@ -28,52 +64,54 @@ def get_required_parameters():
     print("📋 DocuSense Infrastructure Deployment")
     print("=" * 50)
     
+    _init_readline()
+    
     # Environment
-    env_name = input("Environment (dev/stage/prod) [dev]: ").strip() or "dev"
+    env_name = prompt("Environment (dev/stage/prod): ", "dev")
     
     # Resource Group
-    resource_group = input(f"Resource Group [docusense-{env_name}-rg]: ").strip() or f"docusense-{env_name}-rg"
+    resource_group = prompt("Resource Group: ", f"docusense-{env_name}-rg")
     
     # Location
-    location = input("Azure Region [eastus]: ").strip() or "eastus"
+    location = prompt("Azure Region: ", "eastus")
     
     # Search SKU
     print("\nAzure AI Search SKUs:")
     print("  basic    - $250/month, 2GB storage, 15M docs")
     print("  standard - $1000/month, 25GB storage, 50M docs")
     print("  standard3- $6000/month, 1TB storage, 200M docs")
-    search_sku = input("Search SKU [standard]: ").strip() or "standard"
+    search_sku = prompt("Search SKU: ", "standard")
     
     # Function SKU
     print("\nFunction App SKUs:")
     print("  Y1  - Consumption (pay-per-use)")
     print("  EP1 - Premium ($200/month, better performance)")
-    func_sku = input("Function SKU [Y1]: ").strip() or "Y1"
+    func_sku = prompt("Function SKU: ", "Y1")
     
     # Get secrets
     print("\n🔐 Required Secrets:")
     
-    openai_endpoint = input("Azure OpenAI Endpoint: ").strip()
+    openai_endpoint = prompt("Azure OpenAI Endpoint: ")
     if not openai_endpoint:
         print("❌ Azure OpenAI Endpoint is required")
         sys.exit(1)
     
-    openai_key = input("Azure OpenAI API Key: ").strip()
+    openai_key = prompt("Azure OpenAI API Key: ", secret=True)
     if not openai_key:
         print("❌ Azure OpenAI API Key is required")
         sys.exit(1)
     
-    graph_client_id = input("Microsoft Graph Client ID: ").strip()
+    graph_client_id = prompt("Microsoft Graph Client ID: ")
     if not graph_client_id:
         print("❌ Microsoft Graph Client ID is required")
         sys.exit(1)
     
-    graph_client_secret = input("Microsoft Graph Client Secret: ").strip()
+    graph_client_secret = prompt("Microsoft Graph Client Secret: ", secret=True)
     if not graph_client_secret:
         print("❌ Microsoft Graph Client Secret is required")
         sys.exit(1)
     
-    tenant_id = input("Azure AD Tenant ID: ").strip()
+    tenant_id = prompt("Azure AD Tenant ID: ")
     if not tenant_id:
         print("❌ Azure AD Tenant ID is required")
         sys.exit(1)
@@ -91,20 +129,6 @@ def get_required_parameters():
         "tenantId": tenant_id
     }
 
-def create_resource_group(resource_group, location):
-    """Create resource group if it doesn't exist."""
-    print(f"📦 Creating resource group: {resource_group}")
-    
-    # Check if exists
-    result = run_command(f"az group show --name {resource_group}", check=False)
-    if result.returncode == 0:
-        print("✅ Resource group already exists")
-        return
-    
-    # Create resource group
-    run_command(f"az group create --name {resource_group} --location {location}")
-    print("✅ Resource group created")
-
 def deploy_infrastructure(params):
     """Deploy infrastructure using Bicep template."""
     print("🚀 Deploying infrastructure...")
@@ -114,43 +138,29 @@ def deploy_infrastructure(params):
         print(f"❌ Bicep template not found: {bicep_file}")
         sys.exit(1)
     
-    # Build deployment command
-    cmd = f"""az deployment group create \\
-        --resource-group {params['resourceGroup']} \\
-        --template-file {bicep_file} \\
-        --parameters envName={params['envName']} \\
-                    location={params['location']} \\
-                    searchSku={params['searchSku']} \\
-                    funcSku={params['funcSku']} \\
-                    openAiEndpoint={params['openAiEndpoint']} \\
-                    openAiApiKey={params['openAiApiKey']} \\
-                    graphClientId={params['graphClientId']} \\
-                    graphClientSecret={params['graphClientSecret']} \\
-                    tenantId={params['tenantId']}"""
-    
-    result = run_command(cmd)
-    
-    # Parse outputs
-    if result.stdout:
-        try:
-            deployment_result = json.loads(result.stdout)
-            outputs = deployment_result.get("properties", {}).get("outputs", {})
-            
-            # Save outputs to file
-            output_file = f"deployment-outputs-{params['envName']}.json"
-            with open(output_file, 'w') as f:
-                json.dump(outputs, f, indent=2)
-            
-            print("✅ Infrastructure deployed successfully!")
-            print(f"📄 Outputs saved to: {output_file}")
-            
-            return outputs
-            
-        except json.JSONDecodeError:
-            print("⚠️  Could not parse deployment outputs")
-            return {}
-    
-    return {}
+    # Everything except the resource group is a template parameter
+    template_params = {k: v for k, v in params.items() if k != "resourceGroup"}
+    deployment = run_deployment(params['resourceGroup'], bicep_file, template_params)
+    
+    if not deployment_succeeded(deployment):
+        error = (deployment or {}).get("properties", {}).get("error")
+        print("❌ Deployment failed")
+        if error:
+            print(f"Error: {json.dumps(error, indent=2)}")
+        sys.exit(1)
+    
+    # Outputs come straight from the deployment resource
+    outputs = deployment.get("properties", {}).get("outputs") or {}
+    
+    # Save outputs to file
+    output_file = f"deployment-outputs-{params['envName']}.json"
+    with open(output_file, 'w') as f:
+        json.dump(outputs, f, indent=2)
+    
+    print("✅ Infrastructure deployed successfully!")
+    print(f"📄 Outputs saved to: {output_file}")
+    
+    return outputs
 
 def display_deployment_summary(outputs):
     """Display deployment summary."""
@@ -187,14 +197,13 @@ def display_deployment_summary(outputs):
 def main():
     """Main deployment function."""
     try:
-        # Check Azure CLI
-        result = run_command("az --version", check=False)
-        if result.returncode != 0:
+        # Check Azure CLI - a PATH lookup, not a multi-second `az --version` cold start
+        if shutil.which("az") is None:
             print("❌ Azure CLI not found. Please install: https://aka.ms/installazurecli")
             sys.exit(1)
         
         # Check login
-        result = run_command("az account show", check=False)
+        result = cached_az(["az", "account", "show"])
         if result.returncode != 0:
             print("❌ Not logged into Azure. Please run: az login")
             sys.exit(1)
@@ -203,7 +212,7 @@ def main():
         params = get_required_parameters()
         
         # Create resource group
-        create_resource_group(params["resourceGroup"], params["location"])
+        ensure_rg(params["resourceGroup"], params["location"])
         
         # Deploy infrastructure
         outputs = deploy_infrastructure(params)
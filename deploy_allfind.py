@@ -4,20 +4,22 @@ AllFind Production Deployment Script
 Deploys with clean, branded resource names
 """
 
-import subprocess
 import json
 import os
+import re
 import sys
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 
-def run_command(cmd, check=True):
-    """Run a command and return the result"""
-    print(f"🔧 Running: {cmd}")
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    if check and result.returncode != 0:
-        print(f"❌ Command failed: {result.stderr}")
-        sys.exit(1)
-    return result
+from deploy_common import cached_az, deployment_succeeded, ensure_rg, invalidate_cached_az, run_deployment, run_many
+
+# DocuSense -> AllFind and docusense -> allfind in one case-preserving pass
+BRAND_PATTERN = re.compile(r'DocuSense|docusense')
+
+def rebrand(text):
+    """Replace DocuSense branding with AllFind, preserving case"""
+    return BRAND_PATTERN.sub(lambda m: 'AllFind' if m.group(0)[0].isupper() else 'allfind', text)
 
 def main():
     print("🚀 AllFind Production Deployment")
@@ -42,7 +44,7 @@ def main():
     
     # Check if logged into Azure
     print("🔐 Checking Azure login...")
-    result = run_command("az account show", check=False)
+    result = cached_az(["az", "account", "show"])
     if result.returncode != 0:
         print("❌ Not logged into Azure. Please run: az login")
         sys.exit(1)
@@ -52,10 +54,16 @@ def main():
     print(f"   Subscription: {account['name']}")
     print()
     
-    # Get existing Azure AD apps
-    print("🔍 Finding existing Azure AD applications...")
-    api_app = run_command("az ad app list --display-name 'DocuSense-API' --query '[0].appId' -o tsv")
-    spa_app = run_command("az ad app list --display-name 'DocuSense' --query '[0].appId' -o tsv")
+    # Get existing Azure AD apps and the OpenAI resource - these lookups are independent
+    print("🔍 Finding existing Azure AD applications and OpenAI resource...")
+    lookup_cmds = {
+        "api_app": ["az", "ad", "app", "list", "--display-name", "DocuSense-API", "--query", "[0].appId", "-o", "tsv"],
+        "spa_app": ["az", "ad", "app", "list", "--display-name", "DocuSense", "--query", "[0].appId", "-o", "tsv"],
+        "openai": ["az", "cognitiveservices", "account", "list", "--query", "[]", "-o", "json"],
+    }
+    lookups = run_many(lookup_cmds, runner=partial(cached_az, check=True))
+    api_app = lookups["api_app"]
+    spa_app = lookups["spa_app"]
     tenant_id = account['tenantId']
     
     if not api_app.stdout.strip() or not spa_app.stdout.strip():
@@ -67,13 +75,11 @@ def main():
     print()
     
     # Create resource group
-    print(f"📦 Creating resource group: {config['resourceGroup']}")
-    run_command(f"az group create --name {config['resourceGroup']} --location {config['location']}")
+    ensure_rg(config['resourceGroup'], config['location'])
     
     # Get OpenAI resource
     print("🤖 Finding OpenAI resource...")
-    openai_result = run_command("az cognitiveservices account list --query \"[]\" -o json")
-    all_accounts = json.loads(openai_result.stdout)
+    all_accounts = json.loads(lookups["openai"].stdout)
     
     # Find OpenAI account
     openai_info = None
@@ -87,6 +93,8 @@ def main():
             break
     
     if not openai_info:
+        # Don't let the cached account list hide one created before the rerun
+        invalidate_cached_az(lookup_cmds["openai"])
         print("❌ No OpenAI resource found. Please create one first.")
         sys.exit(1)
         
@@ -96,15 +104,14 @@ def main():
     # Deploy Bicep template with new names
     print("🏗️  Deploying AllFind infrastructure...")
     
-    # Get OpenAI API key
-    print("🔑 Getting OpenAI API key...")
-    openai_key_result = run_command(f"az cognitiveservices account keys list --name {openai_info['name']} --resource-group {openai_info['resourceGroup']} --query 'key1' -o tsv")
-    openai_key = openai_key_result.stdout.strip()
-    
-    # Create client secret for API app
-    print("🔐 Creating client secret for API app...")
-    secret_result = run_command(f"az ad app credential reset --id {api_app.stdout.strip()} --query 'password' -o tsv")
-    client_secret = secret_result.stdout.strip()
+    # Get OpenAI API key and create a client secret for the API app
+    print("🔑 Getting OpenAI API key and creating client secret for API app...")
+    secrets = run_many({
+        "openai_key": ["az", "cognitiveservices", "account", "keys", "list", "--name", openai_info['name'], "--resource-group", openai_info['resourceGroup'], "--query", "key1", "-o", "tsv"],
+        "client_secret": ["az", "ad", "app", "credential", "reset", "--id", api_app.stdout.strip(), "--query", "password", "-o", "tsv"],
+    })
+    openai_key = secrets["openai_key"].stdout.strip()
+    client_secret = secrets["client_secret"].stdout.strip()
     
     bicep_params = {
         "envName": "prod",
@@ -117,33 +124,12 @@ def main():
         "adminEmail": "admin@allfind.ai"
     }
     
-    # Create parameter string
-    param_string = " ".join([f"{k}={v}" for k, v in bicep_params.items()])
-    
-    deploy_cmd = f"""
-    az deployment group create \\
-        --resource-group {config['resourceGroup']} \\
-        --template-file allfind.bicep \\
-        --parameters {param_string}
-    """
-    
-    print("📋 Deployment command:")
-    print(deploy_cmd)
-    print()
-    
     # Create updated Bicep file with clean names
     print("📝 Creating AllFind Bicep template...")
     
     # Read existing bicep and update names
-    with open('docusense.bicep', 'r') as f:
-        bicep_content = f.read()
-    
-    # Replace resource names
-    bicep_content = bicep_content.replace('docusense', 'allfind')
-    bicep_content = bicep_content.replace('DocuSense', 'AllFind')
-    
-    with open('allfind.bicep', 'w') as f:
-        f.write(bicep_content)
+    bicep_content = Path('docusense.bicep').read_text(encoding='utf-8')
+    Path('allfind.bicep').write_text(rebrand(bicep_content), encoding='utf-8')
     
     print("✅ Created allfind.bicep with clean resource names")
     print()
@@ -166,10 +152,10 @@ def main():
         print("❌ Deployment cancelled")
         sys.exit(0)
     
-    # Deploy
-    result = run_command(deploy_cmd)
+    # Deploy - parameters (including secrets) go through a private @file, not argv
+    deployment = run_deployment(config['resourceGroup'], "allfind.bicep", bicep_params)
     
-    if result.returncode == 0:
+    if deployment_succeeded(deployment):
         print("✅ AllFind infrastructure deployed successfully!")
         print()
         print("🎯 Next steps:")
@@ -179,7 +165,9 @@ def main():
         print("4. Update branding from DocuSense to AllFind")
     else:
         print("❌ Deployment failed")
-        print(result.stderr)
+        error = (deployment or {}).get("properties", {}).get("error")
+        if error:
+            print(json.dumps(error, indent=2))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
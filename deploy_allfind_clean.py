@@ -4,25 +4,9 @@ Clean AllFind Deployment Script
 Deploys AllFind to a clean AllFind resource group with proper naming
 """
 
-import subprocess
-import json
 import sys
 
-def run_command(cmd, description):
-    """Run a command and return the result"""
-    print(f"🔄 {description}")
-    print(f"   Command: {cmd}")
-    
-    try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Error: {result.stderr}")
-            return None
-        print(f"✅ Success")
-        return result.stdout
-    except Exception as e:
-        print(f"❌ Exception: {e}")
-        return None
+from deploy_common import deployment_succeeded, ensure_rg, run_deployment
 
 def main():
     print("🚀 Starting Clean AllFind Deployment")
@@ -30,23 +14,17 @@ def main():
     
     # 1. Ensure AllFind resource group exists
     print("\n1. Creating AllFind Resource Group")
-    run_command(
-        "az group create --name AllFind --location canadaeast",
-        "Creating AllFind resource group in Canada East"
-    )
+    ensure_rg("AllFind", "canadaeast")
     
     # 2. Deploy Bicep template
     print("\n2. Deploying AllFind Infrastructure")
-    result = run_command(
-        "az deployment group create --resource-group AllFind --template-file allfind.bicep --parameters envName=prod",
-        "Deploying AllFind Bicep template"
-    )
+    print("🔄 Deploying AllFind Bicep template")
+    deployment = run_deployment("AllFind", "allfind.bicep", {"envName": "prod"})
     
-    if result:
+    if deployment_succeeded(deployment):
         # Parse deployment outputs
         try:
-            deployment_data = json.loads(result)
-            outputs = deployment_data.get('properties', {}).get('outputs', {})
+            outputs = deployment.get('properties', {}).get('outputs') or {}
             
             static_url = outputs.get('staticWebAppUrl', {}).get('value', '')
             api_url = outputs.get('apiUrl', {}).get('value', '')
@@ -65,13 +43,16 @@ def main():
             
         except Exception as e:
             print(f"⚠️ Could not parse deployment outputs: {e}")
+    else:
+        print("❌ Error: AllFind deployment failed")
     
-    # 4. List all resources
-    print("\n4. AllFind Resources Created:")
-    run_command(
-        "az resource list --resource-group AllFind --output table",
-        "Listing AllFind resources"
-    )
+    # 4. List all resources - straight from the deployment outputs, no extra ARM list call
+    if deployment_succeeded(deployment):
+        print("\n4. AllFind Resources Created:")
+        resources = deployment['properties'].get('outputs', {}).get('resourceList', {}).get('value', [])
+        print(f"   {'Name':30} {'Type':50}")
+        for resource in resources:
+            print(f"   {resource['name']:30} {resource['type']:50}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the DocuSense/AllFind deployment scripts
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+CACHE_DIR = Path.home() / ".cache" / "docusense"
+AZ_CACHE_TTL = 3600  # seconds
+
+
+def _run(cmd):
+    """Run a command (given as an argv list) without a shell and return the CompletedProcess"""
+    # Resolve through PATH ourselves so az.cmd is found on Windows without a shell
+    executable = shutil.which(cmd[0]) or cmd[0]
+    try:
+        return subprocess.run([executable, *cmd[1:]], capture_output=True, text=True)
+    except FileNotFoundError as e:
+        return subprocess.CompletedProcess(cmd, 127, "", str(e))
+
+
+def run_command(cmd, check=True, description=None):
+    """
+    Run a command (given as an argv list) and return the CompletedProcess.
+
+    With check=True a non-zero exit prints the error and exits the script.
+    """
+    if description:
+        print(f"🔄 {description}...")
+    print(f"🔧 Running: {shlex.join(cmd)}")
+    result = _run(cmd)
+    if check and result.returncode != 0:
+        print(f"❌ Command failed: {shlex.join(cmd)}")
+        print(f"Error: {result.stderr}")
+        sys.exit(1)
+    return result
+
+
+def run_many(cmds, runner=run_command):
+    """Run independent commands concurrently; takes {name: cmd} and returns {name: result}"""
+    with ThreadPoolExecutor(max_workers=min(8, len(cmds))) as executor:
+        results = executor.map(runner, cmds.values())
+        return dict(zip(cmds.keys(), results))
+
+
+def write_text_atomic(path, content):
+    """
+    Write `content` to `path` via a fsync'd temp file and os.replace, so a crash
+    never leaves a half-written file behind.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _az_cache_path(cmd):
+    key = hashlib.sha1("\0".join(cmd).encode("utf-8")).hexdigest()
+    return CACHE_DIR / "az" / f"{key}.json"
+
+
+def cached_az(cmd, ttl=AZ_CACHE_TTL, check=False, description=None):
+    """
+    Run an az command, reusing its result from the on-disk cache if younger than `ttl`.
+
+    Only use this for lookups that rarely change (account, tenant, AD app ids) -
+    never for commands that return secrets. Failed and empty results (a lookup
+    that found nothing) are never cached, so a rerun sees newly created resources.
+    `check` and `description` are passed through to run_command on a cache miss.
+    """
+    path = _az_cache_path(cmd)
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+        if time.time() - entry["ts"] < ttl:
+            print(f"♻️  Cached: {shlex.join(cmd)}")
+            return subprocess.CompletedProcess(cmd, entry["returncode"], entry["stdout"], entry["stderr"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = run_command(cmd, check=check, description=description)
+
+    if result.returncode != 0 or result.stdout.strip() in ("", "[]", "{}", "null"):
+        invalidate_cached_az(cmd)
+        return result
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(path, json.dumps({
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "returncode": result.returncode,
+            "ts": time.time(),
+        }))
+    except OSError as e:
+        print(f"⚠️  Could not write az cache: {e}")
+
+    return result
+
+
+def invalidate_cached_az(cmd):
+    """Drop the cached result for an az command, if any"""
+    try:
+        _az_cache_path(cmd).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def ensure_rg(name, location):
+    """
+    Create resource group `name` in `location` unless it already exists.
+
+    Uses `az group exists` (cheaper than `show`) through the az cache, so reruns
+    against an existing group skip the ARM round-trip entirely. Returns True if
+    the group was created.
+    """
+    exists_cmd = ["az", "group", "exists", "--name", name]
+    result = cached_az(exists_cmd)
+    if result.returncode == 0 and result.stdout.strip() == "true":
+        print(f"✅ Resource group already exists: {name}")
+        return False
+
+    # Only a positive answer is worth remembering
+    invalidate_cached_az(exists_cmd)
+
+    print(f"📦 Creating resource group: {name} ({location})")
+    run_command(["az", "group", "create", "--name", name, "--location", location])
+    print("✅ Resource group created")
+    return True
+
+
+def compile_bicep(path):
+    """
+    Compile a Bicep template to ARM JSON, cached by a hash of its source.
+
+    Returns the path of the cached ARM template, or the original .bicep path if
+    compilation failed (az will then compile it itself during deployment).
+    """
+    path = Path(path)
+    digest = hashlib.blake2b(path.read_bytes()).hexdigest()
+    compiled = CACHE_DIR / "bicep" / f"{digest}.json"
+    if compiled.exists():
+        print(f"♻️  Using compiled template for {path.name}")
+        return compiled
+
+    compiled.parent.mkdir(parents=True, exist_ok=True)
+    # Build to a temp name so an interrupted build never looks like a cache hit
+    tmp_path = compiled.with_suffix(".tmp")
+    cmd = ["az", "bicep", "build", "--file", str(path), "--outfile", str(tmp_path)]
+    print(f"🔧 Running: {shlex.join(cmd)}")
+    result = _run(cmd)
+    if result.returncode != 0:
+        print(f"⚠️  Could not pre-compile {path.name}: {result.stderr}")
+        return path
+    os.replace(tmp_path, compiled)
+    return compiled
+
+
+ARM_PARAMETERS_SCHEMA = "https://schema.management.azure.com/schemas/2019-04-01/deploymentParameters.json#"
+DEPLOYMENT_POLL_INTERVAL = 10  # seconds
+_TERMINAL_STATES = {"Succeeded", "Failed", "Canceled"}
+_MAX_POLL_ERRORS = 6
+
+
+@contextmanager
+def parameters_file(parameters):
+    """
+    Write `parameters` ({name: value}) to a private ARM parameters file and yield its path.
+
+    Secrets never pass through argv this way; the file is readable only by the
+    current user and removed on exit.
+    """
+    fd, path = tempfile.mkstemp(prefix="docusense-params-", suffix=".json")
+    try:
+        os.chmod(path, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({
+                "$schema": ARM_PARAMETERS_SCHEMA,
+                "contentVersion": "1.0.0.0",
+                "parameters": {name: {"value": value} for name, value in parameters.items()},
+            }, f, indent=2)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def run_deployment(resource_group, template_file, parameters, name=None, poll_interval=DEPLOYMENT_POLL_INTERVAL):
+    """
+    Start a resource group deployment without blocking on az and poll ARM until it finishes.
+
+    `parameters` is a {name: value} dict, passed to az as an @file parameters file.
+
+    Returns the deployment resource as a dict (check properties.provisioningState),
+    or None if the deployment could not be started or its state could not be read.
+    """
+    name = name or f"{Path(template_file).stem}-{time.strftime('%Y%m%d%H%M%S')}"
+    if Path(template_file).suffix == ".bicep":
+        template_file = compile_bicep(template_file)
+    with parameters_file(parameters) as params_path:
+        cmd = [
+            "az", "deployment", "group", "create",
+            "--resource-group", resource_group,
+            "--name", name,
+            "--template-file", str(template_file),
+            "--no-wait",
+            "--parameters", f"@{params_path}",
+        ]
+        print(f"🔧 Running: {shlex.join(cmd)}")
+        result = _run(cmd)
+    if result.returncode != 0:
+        print(f"❌ Could not start deployment: {result.stderr}")
+        return None
+
+    show_cmd = ["az", "deployment", "group", "show", "--resource-group", resource_group, "--name", name]
+    started = time.monotonic()
+    errors = 0
+    while True:
+        time.sleep(poll_interval)
+        result = _run([*show_cmd, "--query", "properties.provisioningState", "--output", "tsv"])
+        if result.returncode != 0:
+            # The deployment resource can take a moment to appear after --no-wait
+            errors += 1
+            if errors >= _MAX_POLL_ERRORS:
+                print(f"❌ Could not read deployment state: {result.stderr}")
+                return None
+            continue
+        errors = 0
+        state = result.stdout.strip()
+        print(f"[🚀] provisioningState={state} ({int(time.monotonic() - started)}s)")
+        if state in _TERMINAL_STATES:
+            break
+
+    result = _run([*show_cmd, "--output", "json"])
+    if result.returncode != 0:
+        print(f"❌ Could not read deployment result: {result.stderr}")
+        return None
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        print("⚠️  Could not parse deployment result")
+        return None
+
+
+def deployment_succeeded(deployment):
+    """True if a deployment dict returned by run_deployment finished successfully"""
+    return bool(deployment) and deployment.get("properties", {}).get("provisioningState") == "Succeeded"
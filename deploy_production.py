@@ -4,43 +4,39 @@ Production deployment script for DocuSense.
 Deploys the complete infrastructure to Azure.
 """
 
-import subprocess
 import json
 import sys
 from pathlib import Path
 
-def run_command(cmd, description):
-    """Run a command and return the result."""
-    print(f"🔄 {description}...")
-    try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error: {e}")
-        print(f"Output: {e.stdout}")
-        print(f"Error: {e.stderr}")
-        sys.exit(1)
+from deploy_common import (
+    cached_az,
+    deployment_succeeded,
+    run_command,
+    run_deployment,
+    run_many,
+    write_text_atomic,
+)
 
 def get_azure_resources():
     """Get existing Azure resource details."""
     print("📋 Gathering existing Azure resources...")
     
-    # Get OpenAI details
-    openai_endpoint = run_command(
-        "az cognitiveservices account show --name docusense-azure-open-ai --resource-group DocuSense --query 'properties.endpoint' --output tsv",
-        "Getting Azure OpenAI endpoint"
-    )
-    
-    openai_key = run_command(
-        "az cognitiveservices account keys list --name docusense-azure-open-ai --resource-group DocuSense --query 'key1' --output tsv",
-        "Getting Azure OpenAI API key"
-    )
-    
-    # Get tenant ID
-    tenant_id = run_command(
-        "az account show --query tenantId --output tsv",
-        "Getting Azure tenant ID"
-    )
+    # OpenAI endpoint and key are independent lookups; the tenant ID rarely changes
+    print("🔄 Getting Azure OpenAI endpoint and API key...")
+    lookups = run_many({
+        "openai_endpoint": ["az", "cognitiveservices", "account", "show", "--name", "docusense-azure-open-ai",
+                            "--resource-group", "DocuSense", "--query", "properties.endpoint", "--output", "tsv"],
+        "openai_key": ["az", "cognitiveservices", "account", "keys", "list", "--name", "docusense-azure-open-ai",
+                       "--resource-group", "DocuSense", "--query", "key1", "--output", "tsv"],
+    })
+    openai_endpoint = lookups["openai_endpoint"].stdout.strip()
+    openai_key = lookups["openai_key"].stdout.strip()
+    
+    tenant_id = cached_az(
+        ["az", "account", "show", "--query", "tenantId", "--output", "tsv"],
+        check=True,
+        description="Getting Azure tenant ID"
+    ).stdout.strip()
     
     # Azure AD app IDs (from our previous setup)
     api_client_id = "1c709570-f530-46ac-a366-db21f372cd53"  # DocuSense-API
@@ -61,29 +57,34 @@ def deploy_infrastructure(resources):
     # We need a client secret for the API app - let's create one
     print("🔑 Creating client secret for API app...")
     client_secret_result = run_command(
-        f"az ad app credential reset --id {resources['api_client_id']} --query password --output tsv",
-        "Creating client secret"
-    )
+        ["az", "ad", "app", "credential", "reset", "--id", resources['api_client_id'],
+         "--query", "password", "--output", "tsv"],
+        description="Creating client secret"
+    ).stdout.strip()
     
     # Prepare deployment parameters
-    params = [
-        f"envName=prod",
-        f"openAiApiKey={resources['openai_key']}",
-        f"openAiEndpoint={resources['openai_endpoint']}",
-        f"graphClientId={resources['api_client_id']}",
-        f"graphClientSecret={client_secret_result}",
-        f"tenantId={resources['tenant_id']}",
-        f"adminEmail=antoine@wonderlabs.ca"  # Update this to your email
-    ]
-    
-    # Deploy the Bicep template
-    deployment_cmd = f"az deployment group create --resource-group DocuSense --template-file docusense.bicep --parameters {' '.join(params)}"
+    params = {
+        "envName": "prod",
+        "openAiApiKey": resources['openai_key'],
+        "openAiEndpoint": resources['openai_endpoint'],
+        "graphClientId": resources['api_client_id'],
+        "graphClientSecret": client_secret_result,
+        "tenantId": resources['tenant_id'],
+        "adminEmail": "antoine@wonderlabs.ca"  # Update this to your email
+    }
     
+    # Deploy the Bicep template, polling ARM for progress instead of blocking on az
     print("📦 Deploying infrastructure (this may take 5-10 minutes)...")
-    result = run_command(deployment_cmd, "Deploying Bicep template")
+    deployment = run_deployment("DocuSense", "docusense.bicep", params)
+    if not deployment_succeeded(deployment):
+        print("❌ Error: Bicep deployment failed")
+        error = (deployment or {}).get("properties", {}).get("error")
+        if error:
+            print(f"Error: {json.dumps(error, indent=2)}")
+        sys.exit(1)
     
     # Parse deployment outputs
-    outputs = json.loads(result)['properties']['outputs']
+    outputs = deployment['properties']['outputs']
     
     return {
         "api_url": outputs['apiEndpoint']['value'],
@@ -93,38 +94,37 @@ def deploy_infrastructure(resources):
         "search_endpoint": outputs['searchEndpoint']['value']
     }
 
-def update_environment_files(resources, deployment_outputs):
-    """Update environment files with production URLs."""
-    print("📝 Updating environment files...")
-    
-    # Update backend .env
-    backend_env = f"""# Production Environment Configuration
+BACKEND_ENV_TEMPLATE = """# Production Environment Configuration
 # Azure AD Configuration
-AAD_TENANT_ID={resources['tenant_id']}
-AAD_CLIENT_ID={resources['api_client_id']}
+AAD_TENANT_ID={tenant_id}
+AAD_CLIENT_ID={api_client_id}
 
 # Auth Mode (production)
 USE_SIMPLE_AUTH=false
 
 # Azure Resources
-AZURE_SEARCH_ENDPOINT={deployment_outputs['search_endpoint']}
-AZURE_OPENAI_ENDPOINT={resources['openai_endpoint']}
+AZURE_SEARCH_ENDPOINT={search_endpoint}
+AZURE_OPENAI_ENDPOINT={openai_endpoint}
 """
-    
-    with open("docusense-backend/.env.prod", "w") as f:
-        f.write(backend_env)
-    
-    # Update frontend .env
-    frontend_env = f"""# Production Environment Configuration
-REACT_APP_API_BASE={deployment_outputs['api_url']}
-REACT_APP_SPACLIENT_ID={resources['spa_client_id']}
-REACT_APP_TENANT_ID={resources['tenant_id']}
-REACT_APP_API_CLIENT_ID={resources['api_client_id']}
+
+FRONTEND_ENV_TEMPLATE = """# Production Environment Configuration
+REACT_APP_API_BASE={api_url}
+REACT_APP_SPACLIENT_ID={spa_client_id}
+REACT_APP_TENANT_ID={tenant_id}
+REACT_APP_API_CLIENT_ID={api_client_id}
 REACT_APP_USE_PROD_AUTH=true
 """
+
+def update_environment_files(resources, deployment_outputs):
+    """Update environment files with production URLs."""
+    print("📝 Updating environment files...")
+    
+    # Merge once, then render both files from the same mapping
+    values = {**resources, **deployment_outputs}
     
-    with open("docusense-frontend/.env.production", "w") as f:
-        f.write(frontend_env)
+    # Atomic writes: a crash mid-write must not leave a truncated auth config behind
+    write_text_atomic("docusense-backend/.env.prod", BACKEND_ENV_TEMPLATE.format_map(values))
+    write_text_atomic("docusense-frontend/.env.production", FRONTEND_ENV_TEMPLATE.format_map(values))
     
     print("✅ Environment files updated")
 
@@ -134,9 +134,8 @@ def main():
     print("=" * 50)
     
     # Check if logged into Azure
-    try:
-        run_command("az account show", "Checking Azure login")
-    except:
+    result = cached_az(["az", "account", "show"], description="Checking Azure login")
+    if result.returncode != 0:
         print("❌ Please run 'az login' first")
         sys.exit(1)
     
@@ -2,17 +2,91 @@
 Audit Logging Module
 Generates audit logs from application events and Azure Monitor data
 """
-import csv
-import io
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from itertools import accumulate
 import random
+import sys
+
+# Sample event types and their relative frequency
+EVENT_TYPES = (
+    "search",               # User performed search query
+    "document_ingestion",   # Document ingested from OneDrive/SharePoint
+    "authentication",       # User authentication event
+    "admin_settings",       # Admin configuration change
+    "webhook_event",        # Webhook notification received
+    "error",                # System error occurred
+    "file_upload",          # File uploaded to SharePoint
+)
+EVENT_WEIGHTS = (0.4, 0.2, 0.15, 0.05, 0.1, 0.05, 0.05)
+# Cumulative form, so random.choices doesn't rebuild it on every draw
+EVENT_CUM_WEIGHTS = tuple(accumulate(EVENT_WEIGHTS))
+
+# Values repeated on most rows, interned so every event shares one string object
+RESULT_SUCCESS = sys.intern("success")
+RESULT_FAILED = sys.intern("failed")
+RESULT_ERROR = sys.intern("error")
+SYSTEM_USER = sys.intern("system")
+
+# Sample data pools, shared by every generated event
+FIRST_NAMES = ("john", "jane", "bob", "alice", "charlie", "diana", "frank", "grace")
+LAST_NAMES = ("smith", "johnson", "brown", "davis", "wilson", "moore", "taylor", "anderson")
+DOMAINS = ("contoso.com", "fabrikam.com", "adventure-works.com")
+ADMIN_USERS = (
+    "admin@contoso.com",
+    "it.admin@fabrikam.com",
+    "system.admin@adventure-works.com",
+    "tenant.admin@contoso.com",
+)
+SEARCH_QUERIES = (
+    "quarterly financial report",
+    "teams integration guide",
+    "employee handbook",
+    "project timeline",
+    "budget proposal",
+    "meeting notes",
+    "technical documentation",
+    "policy updates",
+    "training materials",
+    "customer feedback",
+)
+FILE_NAMES = ("report", "document", "presentation", "spreadsheet", "memo", "proposal", "guide", "manual")
+FILE_EXTENSIONS = (".docx", ".xlsx", ".pptx", ".pdf", ".txt")
+AUTH_METHODS = ("Teams SSO", "Browser login", "API token")
+SETTINGS = ("region", "retention_days", "webhook_config")
+SETTING_OLD_VALUES = ("eastus", "90", "enabled")
+SETTING_NEW_VALUES = ("westeurope", "30", "disabled")
+CHANGE_TYPES = ("created", "updated", "deleted")
+WEBHOOK_RESOURCES = ("/me/drive/root", "/sites/root/drives/abc123")
+ERROR_TYPES = ("search_timeout", "auth_failure", "index_error")
+
+CSV_HEADER = "timestamp,event_type,user,details,result,tenant_id,session_id\n"
+EMPTY_CSV_HEADER = "timestamp,event_type,user,details,result\n"
+CSV_CHUNK_ROWS = 1000  # rows per chunk when streaming the CSV
+
+@dataclass(slots=True)
+class AuditEvent:
+    """A single audit log row, in CSV column order"""
+    timestamp: str
+    event_type: str
+    user: str
+    details: str
+    result: str
+    tenant_id: str
+    session_id: str
+
+def _quote(value: str) -> str:
+    """Quote a CSV field, doubling any embedded quotes"""
+    return '"' + value.replace('"', '""') + '"'
 
 class AuditLogger:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None):
         # In production, this would connect to Azure Monitor/Log Analytics
         # self.logs_client = LogsQueryClient(credential=DefaultAzureCredential())
-        pass
+        
+        # Dedicated generator for sample data; pass a seed for reproducible output
+        self._rng = random.Random(seed)
     
     def generate_audit_csv(self, from_date: str, to_date: str, tenant_id: str = "default") -> str:
         """Generate audit log CSV for the specified date range"""
@@ -27,190 +101,197 @@ class AuditLogger:
         # Generate CSV
         return self._events_to_csv(events)
     
-    def _get_audit_events(self, start_date: datetime, end_date: datetime, tenant_id: str) -> List[Dict[str, Any]]:
+    def iter_audit_csv(self, from_date: str, to_date: str, tenant_id: str = "default") -> Iterator[bytes]:
+        """
+        Like generate_audit_csv, but return the CSV as an iterator of UTF-8 chunks
+        for streaming responses, so the whole document is never held as one string.
+        
+        Dates are parsed and events gathered up front, so bad input fails before
+        the response starts.
+        """
+        start_date = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
+        
+        events = self._get_audit_events(start_date, end_date, tenant_id)
+        
+        return self._events_to_csv_iter(events)
+    
+    def _get_audit_events(self, start_date: datetime, end_date: datetime, tenant_id: str) -> List[AuditEvent]:
         """Get audit events for the specified period"""
         
         # For now, generate realistic sample data
         # In production, this would query Azure Monitor/Log Analytics
         
-        events = []
-        current_date = start_date
+        n_days = (end_date - start_date).days + 1
+        if n_days <= 0:
+            return []
         
-        while current_date <= end_date:
-            # Generate 1-5 events per day
-            daily_events = random.randint(1, 5)
-            
-            for _ in range(daily_events):
-                event_time = current_date + timedelta(
-                    hours=random.randint(8, 18),
-                    minutes=random.randint(0, 59),
-                    seconds=random.randint(0, 59)
-                )
-                
-                event = self._generate_sample_event(event_time, tenant_id)
-                events.append(event)
-            
-            current_date += timedelta(days=1)
+        tenant_id = sys.intern(tenant_id)
+        
+        day_offsets, second_offsets, event_types, flips = self._draw_events(n_days)
+        
+        # Event times as integer seconds from start_date: cheaper to build and to
+        # sort on than datetimes or their ISO strings
+        offsets = [day * 86400 + seconds for day, seconds in zip(day_offsets, second_offsets)]
+        session_ids = self._draw_session_ids(len(offsets))
+        
+        events = [
+            self._generate_sample_event(
+                start_date + timedelta(seconds=offset), tenant_id, event_type, flip, session_id
+            )
+            for offset, event_type, flip, session_id in zip(offsets, event_types, flips, session_ids)
+        ]
         
         # Sort events by timestamp
-        events.sort(key=lambda x: x['timestamp'])
+        order = sorted(range(len(events)), key=offsets.__getitem__)
         
-        return events
+        return [events[i] for i in order]
     
-    def _generate_sample_event(self, timestamp: datetime, tenant_id: str) -> Dict[str, Any]:
-        """Generate a realistic sample audit event"""
-        
-        event_types = [
-            ("search", "User performed search query", 0.4),
-            ("document_ingestion", "Document ingested from OneDrive/SharePoint", 0.2),
-            ("authentication", "User authentication event", 0.15),
-            ("admin_settings", "Admin configuration change", 0.05),
-            ("webhook_event", "Webhook notification received", 0.1),
-            ("error", "System error occurred", 0.05),
-            ("file_upload", "File uploaded to SharePoint", 0.05)
-        ]
+    def _draw_events(self, n_days: int) -> Tuple[List[int], List[int], List[str], List[float]]:
+        """
+        Draw the numeric core of the sample events for `n_days` days in a few batch calls.
+        
+        Returns parallel lists of day offset, second of day, event type and a uniform
+        [0, 1) value used for the event's success/failure flip. String formatting is
+        left to _generate_sample_event.
+        """
+        rng = self._rng
+        randrange = rng.randrange
+        uniform = rng.random
+        
+        daily_counts = rng.choices(range(1, 6), k=n_days)  # 1-5 events per day
+        day_offsets = [day for day, count in enumerate(daily_counts) for _ in range(count)]
+        total = len(day_offsets)
+        
+        event_types = rng.choices(EVENT_TYPES, cum_weights=EVENT_CUM_WEIGHTS, k=total)
+        # Between 08:00:00 and 18:59:59
+        second_offsets = [randrange(8 * 3600, 19 * 3600) for _ in range(total)]
+        flips = [uniform() for _ in range(total)]
         
-        # Weighted random selection
-        rand = random.random()
-        cumulative = 0
-        for event_type, description, weight in event_types:
-            cumulative += weight
-            if rand <= cumulative:
-                break
+        return day_offsets, second_offsets, event_types, flips
+    
+    def _draw_session_ids(self, count: int) -> List[str]:
+        """Draw `count` session ids of 32 random bits each, from a single call to the generator"""
+        if count <= 0:
+            return []
+        hex_digits = self._rng.getrandbits(32 * count).to_bytes(4 * count, "big").hex()
+        return [f"sess_{hex_digits[i:i + 8]}" for i in range(0, 8 * count, 8)]
+    
+    def _generate_sample_event(self, timestamp: datetime, tenant_id: str, event_type: str, flip: float, session_id: str) -> AuditEvent:
+        """Generate a realistic sample audit event of the given type"""
+        
+        rng = self._rng
+        choice = rng.choice
+        randint = rng.randint
         
         # Generate event details based on type
         if event_type == "search":
             user = self._random_user()
             query = self._random_search_query()
-            details = f'Query: "{query}", Results: {random.randint(0, 15)}'
-            result = "success"
+            details = f'Query: "{query}", Results: {randint(0, 15)}'
+            result = RESULT_SUCCESS
             
         elif event_type == "document_ingestion":
-            user = "system"
+            user = SYSTEM_USER
             filename = self._random_filename()
-            details = f'File: "{filename}", Size: {random.randint(50, 5000)}KB'
-            result = "success" if random.random() > 0.1 else "failed"
+            details = f'File: "{filename}", Size: {randint(50, 5000)}KB'
+            result = RESULT_SUCCESS if flip > 0.1 else RESULT_FAILED
             
         elif event_type == "authentication":
             user = self._random_user()
-            auth_method = random.choice(["Teams SSO", "Browser login", "API token"])
+            auth_method = choice(AUTH_METHODS)
             details = f'Method: {auth_method}, IP: {self._random_ip()}'
-            result = "success" if random.random() > 0.05 else "failed"
+            result = RESULT_SUCCESS if flip > 0.05 else RESULT_FAILED
             
         elif event_type == "admin_settings":
             user = self._random_admin_user()
-            setting = random.choice(["region", "retention_days", "webhook_config"])
-            old_value = random.choice(["eastus", "90", "enabled"])
-            new_value = random.choice(["westeurope", "30", "disabled"])
+            setting = choice(SETTINGS)
+            old_value = choice(SETTING_OLD_VALUES)
+            new_value = choice(SETTING_NEW_VALUES)
             details = f'Setting: {setting}, Changed from "{old_value}" to "{new_value}"'
-            result = "success"
+            result = RESULT_SUCCESS
             
         elif event_type == "webhook_event":
-            user = "system"
-            change_type = random.choice(["created", "updated", "deleted"])
-            resource = random.choice(["/me/drive/root", "/sites/root/drives/abc123"])
+            user = SYSTEM_USER
+            change_type = choice(CHANGE_TYPES)
+            resource = choice(WEBHOOK_RESOURCES)
             details = f'Change: {change_type}, Resource: {resource}'
-            result = "success" if random.random() > 0.1 else "failed"
+            result = RESULT_SUCCESS if flip > 0.1 else RESULT_FAILED
             
         elif event_type == "error":
             user = self._random_user()
-            error_type = random.choice(["search_timeout", "auth_failure", "index_error"])
-            details = f'Error: {error_type}, Code: {random.randint(400, 599)}'
-            result = "error"
+            error_type = choice(ERROR_TYPES)
+            details = f'Error: {error_type}, Code: {randint(400, 599)}'
+            result = RESULT_ERROR
             
         else:  # file_upload
             user = self._random_user()
             filename = self._random_filename()
             details = f'Uploaded: "{filename}" to SharePoint'
-            result = "success"
-        
-        return {
-            "timestamp": timestamp.isoformat(),
-            "event_type": event_type,
-            "user": user,
-            "details": details,
-            "result": result,
-            "tenant_id": tenant_id,
-            "session_id": f"sess_{random.randint(100000, 999999)}"
-        }
+            result = RESULT_SUCCESS
+        
+        return AuditEvent(
+            timestamp=timestamp.isoformat(),
+            event_type=event_type,
+            user=user,
+            details=details,
+            result=result,
+            tenant_id=tenant_id,
+            session_id=session_id,
+        )
     
     def _random_user(self) -> str:
         """Generate random user email"""
-        first_names = ["john", "jane", "bob", "alice", "charlie", "diana", "frank", "grace"]
-        last_names = ["smith", "johnson", "brown", "davis", "wilson", "moore", "taylor", "anderson"]
-        domains = ["contoso.com", "fabrikam.com", "adventure-works.com"]
-        
-        first = random.choice(first_names)
-        last = random.choice(last_names)
-        domain = random.choice(domains)
-        
-        return f"{first}.{last}@{domain}"
+        choice = self._rng.choice
+        return f"{choice(FIRST_NAMES)}.{choice(LAST_NAMES)}@{choice(DOMAINS)}"
     
     def _random_admin_user(self) -> str:
         """Generate random admin user email"""
-        admin_users = [
-            "admin@contoso.com",
-            "it.admin@fabrikam.com", 
-            "system.admin@adventure-works.com",
-            "tenant.admin@contoso.com"
-        ]
-        return random.choice(admin_users)
+        return self._rng.choice(ADMIN_USERS)
     
     def _random_search_query(self) -> str:
         """Generate random search query"""
-        queries = [
-            "quarterly financial report",
-            "teams integration guide",
-            "employee handbook",
-            "project timeline",
-            "budget proposal",
-            "meeting notes",
-            "technical documentation",
-            "policy updates",
-            "training materials",
-            "customer feedback"
-        ]
-        return random.choice(queries)
+        return self._rng.choice(SEARCH_QUERIES)
     
     def _random_filename(self) -> str:
         """Generate random filename"""
-        names = ["report", "document", "presentation", "spreadsheet", "memo", "proposal", "guide", "manual"]
-        extensions = [".docx", ".xlsx", ".pptx", ".pdf", ".txt"]
-        
-        name = random.choice(names)
-        number = random.randint(1, 100)
-        ext = random.choice(extensions)
+        rng = self._rng
+        name = rng.choice(FILE_NAMES)
+        number = rng.randint(1, 100)
+        ext = rng.choice(FILE_EXTENSIONS)
         
         return f"{name}_{number}{ext}"
     
     def _random_ip(self) -> str:
         """Generate random IP address"""
-        return f"{random.randint(192, 203)}.{random.randint(1, 255)}.{random.randint(1, 255)}.{random.randint(1, 255)}"
+        rng = self._rng
+        return f"{rng.randint(192, 203)}.{rng.randint(1, 255)}.{rng.randint(1, 255)}.{rng.randint(1, 255)}"
+    
+    @staticmethod
+    def _csv_row(e: AuditEvent) -> str:
+        # All columns except details are generated identifiers without commas,
+        # quotes or newlines, so only details needs CSV quoting
+        return (
+            f"{e.timestamp},{e.event_type},{e.user},{_quote(e.details)},"
+            f"{e.result},{e.tenant_id},{e.session_id}\n"
+        )
     
-    def _events_to_csv(self, events: List[Dict[str, Any]]) -> str:
+    def _events_to_csv(self, events: List[AuditEvent]) -> str:
         """Convert events list to CSV string"""
         if not events:
-            return "timestamp,event_type,user,details,result\n"
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(["timestamp", "event_type", "user", "details", "result", "tenant_id", "session_id"])
-        
-        # Write events
-        for event in events:
-            writer.writerow([
-                event["timestamp"],
-                event["event_type"],
-                event["user"],
-                event["details"],
-                event["result"],
-                event["tenant_id"],
-                event["session_id"]
-            ])
-        
-        return output.getvalue()
+            return EMPTY_CSV_HEADER
+        
+        return CSV_HEADER + "".join(map(self._csv_row, events))
+    
+    def _events_to_csv_iter(self, events: List[AuditEvent]) -> Iterator[bytes]:
+        """Convert events list to CSV, yielded as UTF-8 chunks of CSV_CHUNK_ROWS rows"""
+        if not events:
+            yield EMPTY_CSV_HEADER.encode("utf-8")
+            return
+        
+        yield CSV_HEADER.encode("utf-8")
+        for i in range(0, len(events), CSV_CHUNK_ROWS):
+            yield "".join(map(self._csv_row, events[i:i + CSV_CHUNK_ROWS])).encode("utf-8")
     
     def _query_log_analytics(self, start_date: datetime, end_date: datetime, tenant_id: str) -> List[Dict[str, Any]]:
         """Query Log Analytics for audit events (production implementation)"""
@@ -249,4 +330,8 @@ audit_logger = AuditLogger()
 
 def generate_audit_csv(from_date: str, to_date: str, tenant_id: str = "default") -> str:
     """Generate audit log CSV"""
-    return audit_logger.generate_audit_csv(from_date, to_date, tenant_id) 
\ No newline at end of file
+    return audit_logger.generate_audit_csv(from_date, to_date, tenant_id)
+
+def iter_audit_csv(from_date: str, to_date: str, tenant_id: str = "default") -> Iterator[bytes]:
+    """Generate audit log CSV as an iterator of UTF-8 chunks, for streaming"""
+    return audit_logger.iter_audit_csv(from_date, to_date, tenant_id) 
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Token helpers shared by the auth_* modules: cheap pre-checks and unverified
+decoding, Graph nonce normalisation, and the caches in front of signature
+verification and the JWKS.
+"""
+import base64
+import hashlib
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Generic, Optional, Tuple, TypeVar
+import jwt
+import orjson
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Azure AD access tokens are 2-4 KiB; anything far larger is not one
+MAX_TOKEN_LENGTH = 8192
+
+def check_token_shape(token: str) -> None:
+    """Reject oversized or malformed tokens before any decoding, crypto or network work"""
+    if len(token) > MAX_TOKEN_LENGTH:
+        raise HTTPException(401, "Token too large")
+    parts = token.split(".")
+    if len(parts) != 3 or not all(parts):
+        raise HTTPException(401, "Malformed token")
+
+def decode_unverified(token: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Base64/JSON-decode a JWT's header and payload once, without verifying anything"""
+    try:
+        header_b64, payload_b64, _ = token.split(".", 2)
+        header = orjson.loads(base64.urlsafe_b64decode(header_b64 + "=" * (-len(header_b64) % 4)))
+        claims = orjson.loads(base64.urlsafe_b64decode(payload_b64 + "=" * (-len(payload_b64) % 4)))
+    except ValueError as e:  # also covers binascii.Error and orjson.JSONDecodeError
+        raise jwt.DecodeError(f"Malformed token: {e}")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise jwt.DecodeError("Malformed token: header and payload must be JSON objects")
+    return header, claims
+
+_NONCE_RE = re.compile(rb'"nonce"\s*:\s*"([^"\\]+)"')
+
+def normalize_graph_token(token: str) -> str:
+    """For Microsoft Graph access tokens the 'nonce' header arrives in plain text.
+    Azure AD internally hashes this value before signing, therefore the plain
+    token will always fail signature verification.  The fix is to SHA-256 hash
+    the nonce value, base64-url encode it (without padding) and replace it in
+    the JWT header before running signature validation.
+
+    If the token is already in the correct format (nonce already hashed) we
+    return it unchanged so it is safe to call on any Graph token.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header_bytes = base64.urlsafe_b64decode(header_b64 + "=" * (-len(header_b64) % 4))
+
+        # Cheap substring test first - only Graph tokens carry a nonce
+        if b'"nonce"' not in header_bytes:
+            return token  # nothing to fix
+        match = _NONCE_RE.search(header_bytes)
+        if match is None:
+            return token  # nothing to fix
+
+        # Heuristic: hashed nonce is 43 chars (SHA256 => 32 bytes => 43 base64url chars)
+        if len(match.group(1)) == 43:
+            return token  # already hashed
+
+        # Swap the nonce for its hash in place rather than re-serializing the header
+        hashed_b64 = base64.urlsafe_b64encode(hashlib.sha256(match.group(1)).digest()).rstrip(b"=")
+        header_bytes = header_bytes[:match.start(1)] + hashed_b64 + header_bytes[match.end(1):]
+        new_header_b64 = base64.urlsafe_b64encode(header_bytes).decode().rstrip("=")
+        return f"{new_header_b64}.{payload_b64}.{signature_b64}"
+    except Exception:
+        # If anything goes wrong fall back to original token; verification may fail later
+        return token
+
+def hash_token(token: str) -> bytes:
+    """Cache key for a token: its SHA-256, so the token itself is never kept"""
+    return hashlib.sha256(token.encode()).digest()
+
+V = TypeVar("V")
+
+class ExpiringCache(Generic[V]):
+    """
+    Thread-safe map whose entries each carry their own expiry (a time.time()
+    timestamp). Once max_entries is reached, expired entries are dropped, and
+    if that isn't enough, the oldest half.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: Dict[Any, Tuple[float, V]] = {}  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def put(self, key: Any, value: V, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                for k in [k for k, (expiry, _) in self._entries.items() if expiry <= now]:
+                    del self._entries[k]
+                if len(self._entries) >= self.max_entries:
+                    for k in list(self._entries)[:self.max_entries // 2]:
+                        del self._entries[k]
+            self._entries[key] = (expires_at, value)
+
+class VerifiedClaimsCache:
+    """
+    Claims of tokens that already passed signature/issuer validation, keyed by
+    hash_token() and kept until the token expires or `ttl` passes, whichever
+    comes first. Callers still run their role/scope checks on every call.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 50_000):
+        self.ttl = ttl
+        self._cache: ExpiringCache[Dict[str, Any]] = ExpiringCache(max_entries)
+
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        claims = self._cache.get(key)
+        return dict(claims) if claims is not None else None
+
+    def store(self, key: bytes, claims: Dict[str, Any]) -> None:
+        now = time.time()
+        self._cache.put(key, dict(claims), min(claims.get("exp", now), now + self.ttl))
+
+class SigningKeyCache:
+    """
+    Signing keys already resolved by kid, in front of a PyJWKClient so the hot
+    path skips its header parsing and lock. Entries expire after `ttl` (the
+    client's JWKS lifespan), so keys Azure AD has rotated out stop being accepted.
+    """
+
+    def __init__(self, jwk_client: jwt.PyJWKClient, ttl: float):
+        self.jwk_client = jwk_client
+        self.ttl = ttl
+        self._keys: Dict[Optional[str], Tuple[float, Any]] = {}  # kid -> (resolved_at, public_key)
+
+    def key_for(self, kid: Optional[str]) -> Any:
+        """Return the public key for a token's kid"""
+        cached = self._keys.get(kid)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        key = self.jwk_client.get_signing_key(kid).key
+        self._keys[kid] = (time.monotonic(), key)
+        return key
+
+    def warm_up(self) -> bool:
+        """
+        Fetch the JWKS and resolve its signing keys ahead of the first request,
+        so that request doesn't pay for the TLS handshake and download. Safe to
+        call at startup: errors are reported and swallowed.
+        """
+        try:
+            now = time.monotonic()
+            for signing_key in self.jwk_client.get_signing_keys():
+                self._keys[signing_key.key_id] = (now, signing_key.key)
+            return True
+        except Exception as err:
+            logger.warning("Could not pre-fetch JWKS: %s", err)
+            return False
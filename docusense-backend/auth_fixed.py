@@ -1,16 +1,23 @@
+import asyncio
+import logging
 import os
+import threading
+import time
+import httpx
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, List, Optional, Tuple, TypeGuard, TypeVar
 from fastapi import Request, HTTPException, Depends
 from fastapi.security import HTTPBearer
-from jose import jwt, JWTError
+import jwt
+import orjson
 from dotenv import load_dotenv
-import json
-import base64
-import hashlib
+from auth_common import check_token_shape, decode_unverified, normalize_graph_token
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 bearer = HTTPBearer()
 
 # Azure AD configuration
@@ -26,141 +33,234 @@ if not CLIENT_ID:
 ISSUER_V1 = f"https://sts.windows.net/{TENANT_ID}/"
 ISSUER_V2 = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0"
 
-# Cache for JWKS keys and OpenID config
-_jwks_cache = None
-_openid_config_cache = None
+# Shared HTTP session so metadata/JWKS refreshes reuse a pooled keep-alive connection
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Async counterpart used by the FastAPI dependencies, so a cold JWKS fetch
+# doesn't block the event loop
+_async_client = httpx.AsyncClient(timeout=5)
+
+# Cache for JWKS keys and OpenID config, refreshed after CACHE_TTL so rotated
+# Azure AD signing keys are picked up. The JWKS entry also holds the public key
+# objects built from it, keyed by kid, so they are constructed once per refresh
+# instead of once per request.
+CACHE_TTL = 3600  # seconds
+JWKSEntry = Tuple[float, Dict[str, Any], Dict[str, Any]]  # (fetched_at, jwks, {kid: public_key})
+_jwks_cache: Optional[JWKSEntry] = None
+_openid_config_cache: Optional[Tuple[float, Dict[str, Any]]] = None  # (fetched_at, config)
+_cache_lock = threading.Lock()
+_async_cache_lock = asyncio.Lock()  # single-flight refresh for the async path
+
+_Entry = TypeVar("_Entry", bound=Tuple[Any, ...])
+
+def _is_fresh(entry: Optional[_Entry]) -> TypeGuard[_Entry]:
+    return entry is not None and time.monotonic() - entry[0] < CACHE_TTL
 
-def get_openid_configuration():
+def _fetch_json(url: str) -> Dict[str, Any]:
+    response = _session.get(url, timeout=(2, 5))
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+async def _fetch_json_async(url: str) -> Dict[str, Any]:
+    response = await _async_client.get(url)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+def get_openid_configuration() -> Dict[str, Any]:
     """Get OpenID configuration from Azure AD"""
     global _openid_config_cache
-    if _openid_config_cache is None:
+    if _is_fresh(_openid_config_cache):
+        return _openid_config_cache[1]
+    
+    with _cache_lock:
+        if _is_fresh(_openid_config_cache):
+            return _openid_config_cache[1]
         try:
             # Try v2.0 first
             config_url = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0/.well-known/openid-configuration"
-            print(f"🔍 Fetching OpenID config from: {config_url}")
-            response = requests.get(config_url, timeout=10)
-            response.raise_for_status()
-            _openid_config_cache = response.json()
-            print("✅ OpenID configuration fetched successfully")
+            logger.info("Fetching OpenID config from: %s", config_url)
+            config = _fetch_json(config_url)
+            logger.info("OpenID configuration fetched successfully")
         except Exception as e:
-            print(f"❌ Error fetching OpenID config: {e}")
+            logger.warning("Error fetching OpenID config: %s", e)
             # Fallback to v1.0
             try:
                 config_url = f"https://login.microsoftonline.com/{TENANT_ID}/.well-known/openid-configuration"
-                print(f"🔍 Trying v1.0 config: {config_url}")
-                response = requests.get(config_url, timeout=10)
-                response.raise_for_status()
-                _openid_config_cache = response.json()
-                print("✅ v1.0 OpenID configuration fetched successfully")
+                logger.info("Trying v1.0 config: %s", config_url)
+                config = _fetch_json(config_url)
+                logger.info("v1.0 OpenID configuration fetched successfully")
             except Exception as e2:
-                print(f"❌ Error fetching v1.0 config: {e2}")
+                logger.error("Error fetching v1.0 config: %s", e2)
+                if _openid_config_cache is not None:
+                    # Keep serving the stale config rather than failing every request
+                    return _openid_config_cache[1]
                 raise HTTPException(500, "Authentication service unavailable")
-    return _openid_config_cache
+        _openid_config_cache = (time.monotonic(), config)
+        return config
+
+def _build_signing_keys(jwks: Dict[str, Any]) -> Dict[str, Any]:
+    """Materialize the public key object for every usable key in a JWKS, keyed by kid"""
+    keys: Dict[str, Any] = {}
+    for jwk in jwks.get("keys", []):
+        try:
+            keys[jwk["kid"]] = jwt.PyJWK(jwk).key
+        except (KeyError, jwt.PyJWTError):
+            continue  # not a signing key we can use
+    return keys
+
+def _get_jwks_entry() -> JWKSEntry:
+    global _jwks_cache
+    if _is_fresh(_jwks_cache):
+        return _jwks_cache
+    
+    config = get_openid_configuration()
+    with _cache_lock:
+        if _is_fresh(_jwks_cache):
+            return _jwks_cache
+        try:
+            jwks_uri = config.get("jwks_uri")
+            if not jwks_uri:
+                raise Exception("jwks_uri not found in OpenID configuration")
+            
+            logger.info("Fetching JWKS from: %s", jwks_uri)
+            jwks = _fetch_json(jwks_uri)
+            logger.info("JWKS fetched successfully: %s keys", len(jwks.get("keys", [])))
+        except Exception as e:
+            logger.error("Error fetching JWKS: %s", e)
+            if _jwks_cache is not None:
+                # Keep serving the stale keys rather than failing every request
+                return _jwks_cache
+            raise HTTPException(500, "Authentication service unavailable")
+        _jwks_cache = (time.monotonic(), jwks, _build_signing_keys(jwks))
+        return _jwks_cache
 
-def get_jwks():
+def get_jwks() -> Dict[str, Any]:
     """Get JSON Web Key Set from Azure AD using OpenID configuration"""
+    return _get_jwks_entry()[1]
+
+def get_signing_keys() -> Dict[str, Any]:
+    """Get the signing public keys from the JWKS, keyed by kid"""
+    return _get_jwks_entry()[2]
+
+async def get_openid_configuration_async() -> Dict[str, Any]:
+    """Get OpenID configuration from Azure AD without blocking the event loop"""
+    global _openid_config_cache
+    if _is_fresh(_openid_config_cache):
+        return _openid_config_cache[1]
+    
+    async with _async_cache_lock:
+        if _is_fresh(_openid_config_cache):
+            return _openid_config_cache[1]
+        try:
+            # Try v2.0 first
+            config_url = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0/.well-known/openid-configuration"
+            logger.info("Fetching OpenID config from: %s", config_url)
+            config = await _fetch_json_async(config_url)
+            logger.info("OpenID configuration fetched successfully")
+        except Exception as e:
+            logger.warning("Error fetching OpenID config: %s", e)
+            # Fallback to v1.0
+            try:
+                config_url = f"https://login.microsoftonline.com/{TENANT_ID}/.well-known/openid-configuration"
+                logger.info("Trying v1.0 config: %s", config_url)
+                config = await _fetch_json_async(config_url)
+                logger.info("v1.0 OpenID configuration fetched successfully")
+            except Exception as e2:
+                logger.error("Error fetching v1.0 config: %s", e2)
+                if _openid_config_cache is not None:
+                    return _openid_config_cache[1]
+                raise HTTPException(500, "Authentication service unavailable")
+        _openid_config_cache = (time.monotonic(), config)
+        return config
+
+async def _get_jwks_entry_async() -> JWKSEntry:
     global _jwks_cache
-    if _jwks_cache is None:
+    if _is_fresh(_jwks_cache):
+        return _jwks_cache
+    
+    config = await get_openid_configuration_async()
+    async with _async_cache_lock:
+        # Concurrent requests that missed the cache wait here and reuse this fetch
+        if _is_fresh(_jwks_cache):
+            return _jwks_cache
         try:
-            config = get_openid_configuration()
             jwks_uri = config.get("jwks_uri")
             if not jwks_uri:
                 raise Exception("jwks_uri not found in OpenID configuration")
             
-            print(f"🔍 Fetching JWKS from: {jwks_uri}")
-            response = requests.get(jwks_uri, timeout=10)
-            response.raise_for_status()
-            _jwks_cache = response.json()
-            print(f"✅ JWKS fetched successfully: {len(_jwks_cache.get('keys', []))} keys")
+            logger.info("Fetching JWKS from: %s", jwks_uri)
+            jwks = await _fetch_json_async(jwks_uri)
+            logger.info("JWKS fetched successfully: %s keys", len(jwks.get("keys", [])))
         except Exception as e:
-            print(f"❌ Error fetching JWKS: {e}")
+            logger.error("Error fetching JWKS: %s", e)
+            if _jwks_cache is not None:
+                return _jwks_cache
             raise HTTPException(500, "Authentication service unavailable")
-    return _jwks_cache
+        _jwks_cache = (time.monotonic(), jwks, _build_signing_keys(jwks))
+        return _jwks_cache
 
-# Place helper just after global caches but before verify_token function.
-def _normalize_graph_token(token: str) -> str:
-    """Hash the plain 'nonce' header value on Microsoft Graph access tokens so
-    that signature verification succeeds. Returns the original token for other
-    cases."""
-    try:
-        header_b64, payload_b64, signature_b64 = token.split('.')
-        padded = header_b64 + '=' * (-len(header_b64) % 4)
-        header_json = json.loads(base64.urlsafe_b64decode(padded))
-        nonce = header_json.get('nonce')
-        if not nonce or len(nonce) == 43:
-            return token
-        hashed = hashlib.sha256(nonce.encode()).digest()
-        hashed_b64 = base64.urlsafe_b64encode(hashed).decode().rstrip('=')
-        header_json['nonce'] = hashed_b64
-        new_header = base64.urlsafe_b64encode(json.dumps(header_json, separators=(',', ':')).encode()).decode().rstrip('=')
-        return f"{new_header}.{payload_b64}.{signature_b64}"
-    except Exception:
-        return token
+async def get_signing_keys_async() -> Dict[str, Any]:
+    """Get the signing public keys from the JWKS, keyed by kid, without blocking the event loop"""
+    return (await _get_jwks_entry_async())[2]
 
-def verify_token(token: str, required_scope: Optional[str] = None):
-    """Verify JWT token from Azure AD using the recommended pattern"""
+def verify_token(token: str, required_scope: Optional[str] = None, signing_keys: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Verify JWT token from Azure AD using the recommended pattern
+
+    `signing_keys` ({kid: public_key}) skips the JWKS lookup; verify_token_async
+    uses it to pass in keys it already fetched asynchronously.
+    """
+    check_token_shape(token)
+    debug = logger.isEnabledFor(logging.DEBUG)
     try:
         # Before unverified header claims retrieval we can normalize.
-        token = _normalize_graph_token(token)
+        token = normalize_graph_token(token)
         # First, decode without verification to check the header and claims
-        unverified_header = jwt.get_unverified_header(token)
-        unverified_claims = jwt.get_unverified_claims(token)
+        unverified_header, unverified_claims = decode_unverified(token)
         
         audience = unverified_claims.get("aud")
         issuer = unverified_claims.get("iss")
         kid = unverified_header.get("kid")
         
-        print(f"🔍 Token audience: {audience}")
-        print(f"🔍 Token issuer: {issuer}")
-        print(f"🔍 Token kid: {kid}")
-        print(f"🔍 Expected client ID: {CLIENT_ID}")
+        if debug:
+            logger.debug("Token audience: %s", audience)
+            logger.debug("Token issuer: %s", issuer)
+            logger.debug("Token kid: %s", kid)
+            logger.debug("Expected client ID: %s", CLIENT_ID)
         
         if not kid:
-            print("❌ Token missing 'kid' header")
+            logger.warning("Token missing 'kid' header")
             raise HTTPException(401, "Invalid token: missing key ID")
         
-        # Get JWKS and find the signing key
-        jwks = get_jwks()
-        
-        # Find the key which was used to sign the JWT token
-        rsa_key = {}
-        for key in jwks.get("keys", []):
-            if key.get("kid") == kid:
-                rsa_key = {
-                    "kty": key.get("kty"),
-                    "kid": key.get("kid"),
-                    "use": key.get("use"),
-                    "n": key.get("n"),
-                    "e": key.get("e"),
-                }
-                break
-        
-        if not rsa_key:
-            print(f"❌ Unable to find signing key with kid: {kid}")
+        # Find the key which was used to sign the JWT token - an O(1) lookup
+        # into public key objects prebuilt when the JWKS was fetched
+        if signing_keys is None:
+            signing_keys = get_signing_keys()
+        rsa_key = signing_keys.get(kid)
+        if rsa_key is None:
+            logger.warning("Unable to find signing key with kid: %s", kid)
             raise HTTPException(401, "Unable to find appropriate signing key")
         
-        print(f"✅ Found signing key: {kid}")
-        
-        # Determine issuer based on token
-        expected_issuer = issuer  # Use the issuer from the token itself
+        # Determine which of our tenant's issuers (v1.0 or v2.0) to expect based on the token
+        expected_issuer = ISSUER_V1 if issuer == ISSUER_V1 else ISSUER_V2
         
         # Verify the JWT token with appropriate options based on token type
-        options = {"verify_aud": False, "verify_iss": True}
+        options: Dict[str, Any] = {"verify_aud": False, "verify_iss": True}
         
         if audience == "https://graph.microsoft.com":
             # This is a Graph API token - be more lenient
-            print("📊 Detected Graph API token")
             options["verify_aud"] = False
         elif audience == CLIENT_ID or audience == f"api://{CLIENT_ID}":
             # This is our custom API token
-            print("🔑 Detected custom API token")
             options["verify_aud"] = True
         else:
-            print(f"📊 Unknown audience, proceeding with lenient verification: {audience}")
-            options["verify_aud"] = False
+            # Tokens issued for any other app must not be accepted here
+            logger.warning("Unexpected audience: %s", audience)
+            raise HTTPException(401, f"Invalid token audience: {audience}")
         
-        print(f"🔍 Verification options: {options}")
-        print(f"🔍 Expected issuer: {expected_issuer}")
+        if debug:
+            logger.debug("Verification options: %s", options)
+            logger.debug("Expected issuer: %s", expected_issuer)
         
         # Decode and verify the token
         payload = jwt.decode(
@@ -169,70 +269,75 @@ def verify_token(token: str, required_scope: Optional[str] = None):
             algorithms=["RS256"],
             audience=audience if options["verify_aud"] else None,
             issuer=expected_issuer,
-            options=options,
+            options=options,  # type: ignore[arg-type]  # PyJWT >= 2.10 types this as a TypedDict
         )
         
         # Check scopes/roles if required (client-credentials tokens have roles, not scp)
         if required_scope and audience != "https://graph.microsoft.com":
-            scopes = payload.get("scp", "").split() if payload.get("scp") else []
-            roles = payload.get("roles", [])
+            scopes: List[str] = payload.get("scp", "").split() if payload.get("scp") else []
+            roles: List[str] = payload.get("roles", [])
             all_permissions = scopes + roles
             
             if required_scope not in all_permissions:
-                print(f"❌ Missing required scope: {required_scope}")
-                print(f"🔍 Available scopes: {scopes}")
-                print(f"🔍 Available roles: {roles}")
+                logger.warning("Missing required scope: %s (scopes: %s, roles: %s)", required_scope, scopes, roles)
                 raise HTTPException(403, f"Missing required scope or role: {required_scope}")
         
-        print("✅ Token verified successfully")
+        if debug:
+            logger.debug("Token verified successfully")
         return payload
         
-    except JWTError as e:
-        print(f"❌ JWT Error: {e}")
+    except jwt.PyJWTError as e:
+        logger.warning("JWT Error: %s", e)
         raise HTTPException(401, "Invalid token")
     except HTTPException:
         raise  # Re-raise HTTP exceptions
     except Exception as e:
-        print(f"❌ Token verification error: {e}")
+        logger.error("Token verification error: %s", e)
         raise HTTPException(401, "Token verification failed")
 
-async def auth_dependency(request: Request):
+async def verify_token_async(token: str, required_scope: Optional[str] = None) -> Dict[str, Any]:
+    """verify_token for async callers: the JWKS refresh is awaited instead of blocking the event loop"""
+    check_token_shape(token)
+    signing_keys = await get_signing_keys_async()
+    return verify_token(token, required_scope, signing_keys=signing_keys)
+
+async def auth_dependency(request: Request) -> Dict[str, Any]:
     """FastAPI dependency for authentication with required scope"""
     try:
         credentials = await bearer(request)
         if credentials is None:
             raise HTTPException(401, "No credentials provided")
-        claims = verify_token(credentials.credentials, required_scope="api.access")
+        claims = await verify_token_async(credentials.credentials, required_scope="api.access")
         return claims
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Authentication error: {e}")
+        logger.error("Authentication error: %s", e)
         raise HTTPException(401, "Authentication failed")
 
 # Lenient auth for development/testing with Graph tokens
-async def lenient_auth_dependency(request: Request):
+async def lenient_auth_dependency(request: Request) -> Dict[str, Any]:
     """Lenient authentication that accepts Graph API tokens without scope check"""
     try:
         credentials = await bearer(request)
         if credentials is None:
             raise HTTPException(401, "No credentials provided")
-        claims = verify_token(credentials.credentials, required_scope=None)
+        claims = await verify_token_async(credentials.credentials, required_scope=None)
         return claims
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Authentication error: {e}")
+        logger.error("Authentication error: %s", e)
         raise HTTPException(401, "Authentication failed")
 
 # Optional: Create a dependency that doesn't require a specific scope
-async def optional_auth_dependency(request: Request):
+async def optional_auth_dependency(request: Request) -> Optional[Dict[str, Any]]:
     """Optional authentication - returns None if no token provided"""
     try:
         credentials = await bearer(request)
         if credentials is None:
             return None
-        claims = verify_token(credentials.credentials, required_scope=None)
+        claims = await verify_token_async(credentials.credentials, required_scope=None)
         return claims
     except HTTPException:
         return None
@@ -1,13 +1,23 @@
+import copy
+import logging
 import os
+import threading
+import time
 import requests
-from typing import Optional, Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, Tuple, Union
 from fastapi import Request, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
-from jose import jwt
+import jwt
 from dotenv import load_dotenv
+from auth_common import ExpiringCache, check_token_shape, hash_token
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 bearer = HTTPBearer()
 
 # Azure AD configuration
@@ -19,28 +29,112 @@ if not TENANT_ID:
 if not CLIENT_ID:
     print("⚠️  AAD_CLIENT_ID not found in environment variables")
 
+GRAPH_ME_URL = "https://graph.microsoft.com/v1.0/me"
+
+# Shared HTTP session so Graph calls reuse pooled keep-alive connections
+# instead of a new TCP+TLS handshake per request
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 503], allowed_methods=["GET"], raise_on_status=False),
+))
+
+# The optional hybrid Graph check must fail fast rather than retry: a single
+# timed-out attempt is reported to the circuit breaker instead
+_no_retry_session = requests.Session()
+_no_retry_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+
+# Successful Graph /me lookups, keyed by the SHA-256 of the token (never the
+# token itself) and kept until the token expires or GRAPH_CACHE_TTL passes,
+# whichever comes first
+GRAPH_CACHE_TTL = 60  # seconds
+GRAPH_CACHE_MAX_ENTRIES = 10_000
+_graph_cache: ExpiringCache[Dict[str, Any]] = ExpiringCache(GRAPH_CACHE_MAX_ENTRIES)  # token hash -> user_info
+
+def _get_graph_user_info(token: str, timeout: Union[float, Tuple[float, float]], exp: Optional[float] = None,
+                         session: requests.Session = _session) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    Call Graph /me with the token, reusing a cached successful response for the same token.
+
+    Returns (status_code, user_info); user_info is None unless status_code is 200.
+    Only successful responses are cached.
+    """
+    key = hash_token(token)
+    now = time.time()
+    
+    cached = _graph_cache.get(key)
+    if cached is not None:
+        # Callers get their own copy, so changes to it never reach the cache
+        return 200, copy.deepcopy(cached)
+    
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+    response = session.get(GRAPH_ME_URL, headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        return response.status_code, None
+    
+    user_info = response.json()
+    expires_at = now + GRAPH_CACHE_TTL
+    if exp:
+        expires_at = min(expires_at, exp)
+    
+    _graph_cache.put(key, copy.deepcopy(user_info), expires_at)
+    
+    return 200, user_info
+
+# Circuit breaker for the optional Graph check in validate_token_hybrid: after
+# GRAPH_BREAKER_FAIL_MAX consecutive failures the check is skipped for
+# GRAPH_BREAKER_RESET_TIMEOUT seconds; the first failure after that reopens it
+GRAPH_BREAKER_FAIL_MAX = 5
+GRAPH_BREAKER_RESET_TIMEOUT = 30  # seconds
+GRAPH_HYBRID_TIMEOUT = (1.0, 2.0)  # (connect, read) seconds
+_graph_failures = 0
+_graph_open_until = 0.0
+_graph_breaker_lock = threading.Lock()
+
+def _graph_circuit_open() -> bool:
+    """True while Graph calls are being skipped after repeated failures"""
+    with _graph_breaker_lock:
+        return time.monotonic() < _graph_open_until
+
+def _record_graph_result(ok: bool) -> None:
+    """Count consecutive Graph failures and open the circuit once there are too many"""
+    global _graph_failures, _graph_open_until
+    with _graph_breaker_lock:
+        if ok:
+            _graph_failures = 0
+            return
+        _graph_failures += 1
+        if _graph_failures >= GRAPH_BREAKER_FAIL_MAX:
+            _graph_open_until = time.monotonic() + GRAPH_BREAKER_RESET_TIMEOUT
+            logger.warning("Graph failed %s times in a row, skipping Graph validation for %ss",
+                           _graph_failures, GRAPH_BREAKER_RESET_TIMEOUT)
+
 def validate_token_with_userinfo(token: str) -> Dict[str, Any]:
     """Validate token by calling Microsoft Graph userinfo endpoint"""
+    check_token_shape(token)
     try:
-        print("🔍 Validating token with Microsoft Graph...")
+        logger.debug("Validating token with Microsoft Graph")
         
-        # Call Microsoft Graph to validate the token
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        # Also get the token claims without signature verification; their
+        # expiry bounds how long the Graph response may be cached
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False})
+            claims_error = None
+        except Exception as e:
+            claims, claims_error = None, e
         
-        # Try Graph API me endpoint first
-        response = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers, timeout=10)
+        # Call Microsoft Graph me endpoint to validate the token
+        status_code, user_info = _get_graph_user_info(token, timeout=10, exp=claims.get("exp") if claims else None)
         
-        if response.status_code == 200:
-            user_info = response.json()
-            print("✅ Token validated successfully via Graph API")
+        if status_code == 200:
+            logger.debug("Token validated successfully via Graph API")
             
-            # Also get the token claims without signature verification
-            try:
-                claims = jwt.get_unverified_claims(token)
-                print(f"🔍 Token claims extracted")
+            if claims is not None:
+                logger.debug("Token claims extracted")
                 
                 # Combine user info with token claims
                 result = {
@@ -49,9 +143,8 @@ def validate_token_with_userinfo(token: str) -> Dict[str, Any]:
                     "validation_method": "graph_api"
                 }
                 return result
-                
-            except Exception as e:
-                print(f"⚠️  Could not extract claims: {e}")
+            else:
+                logger.warning("Could not extract claims: %s", claims_error)
                 # Return just the user info if claims extraction fails
                 return {
                     "sub": user_info.get("id"),
@@ -61,67 +154,73 @@ def validate_token_with_userinfo(token: str) -> Dict[str, Any]:
                     "validation_method": "graph_api_only"
                 }
         
-        elif response.status_code == 401:
-            print(f"❌ Token validation failed: {response.status_code}")
+        elif status_code == 401:
+            logger.warning("Token validation failed: %s", status_code)
             raise HTTPException(401, "Invalid or expired token")
         else:
-            print(f"❌ Unexpected response from Graph API: {response.status_code}")
-            raise HTTPException(401, f"Token validation failed: {response.status_code}")
+            logger.warning("Unexpected response from Graph API: %s", status_code)
+            raise HTTPException(401, f"Token validation failed: {status_code}")
             
     except requests.exceptions.RequestException as e:
-        print(f"❌ Network error during token validation: {e}")
+        logger.error("Network error during token validation: %s", e)
         raise HTTPException(503, "Authentication service unavailable")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Unexpected error during token validation: {e}")
+        logger.error("Unexpected error during token validation: %s", e)
         raise HTTPException(401, "Token validation failed")
 
 def validate_token_hybrid(token: str, required_scope: Optional[str] = None) -> Dict[str, Any]:
     """Hybrid validation: extract claims without signature verification + validate with Graph API"""
+    check_token_shape(token)
     try:
-        print("🔍 Starting hybrid token validation...")
+        logger.debug("Starting hybrid token validation")
         
         # First, extract claims without signature verification
-        claims = jwt.get_unverified_claims(token)
-        header = jwt.get_unverified_header(token)
+        claims = jwt.decode(token, options={"verify_signature": False})
         
         audience = claims.get("aud")
         issuer = claims.get("iss")
         app_id = claims.get("appid")
         
-        print(f"🔍 Token audience: {audience}")
-        print(f"🔍 Token issuer: {issuer}")
-        print(f"🔍 Token app_id: {app_id}")
+        logger.debug("Token audience: %s", audience)
+        logger.debug("Token issuer: %s", issuer)
+        logger.debug("Token app_id: %s", app_id)
         
         # Basic validation of claims
         if not issuer or not issuer.startswith("https://sts.windows.net/"):
-            print("❌ Invalid issuer")
+            logger.warning("Invalid issuer: %s", issuer)
             raise HTTPException(401, "Invalid token issuer")
         
         # Check if token is expired (basic check)
-        import time
         exp = claims.get("exp")
         if exp and exp < time.time():
-            print("❌ Token expired")
+            logger.warning("Token expired")
             raise HTTPException(401, "Token expired")
         
-        # Validate with Microsoft Graph if it's a Graph token
-        if audience == "https://graph.microsoft.com":
-            print("📊 Graph API token - validating with Microsoft Graph...")
+        # Validate with Microsoft Graph if it's a Graph token; while Graph keeps
+        # failing, skip the (optional) check instead of waiting on it every time
+        if audience == "https://graph.microsoft.com" and _graph_circuit_open():
+            logger.debug("Graph circuit open - skipping Graph validation")
+            claims["graph_validation"] = "circuit_open"
+        elif audience == "https://graph.microsoft.com":
+            logger.debug("Graph API token - validating with Microsoft Graph")
             try:
-                headers = {"Authorization": f"Bearer {token}"}
-                response = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers, timeout=5)
+                status_code, user_info = _get_graph_user_info(token, timeout=GRAPH_HYBRID_TIMEOUT, exp=exp,
+                                                             session=_no_retry_session)
+                # A rejected token is Graph working as intended; only outages count
+                _record_graph_result(status_code < 500 and status_code != 429)
                 
-                if response.status_code == 200:
-                    print("✅ Token validated with Microsoft Graph")
+                if status_code == 200:
+                    logger.debug("Token validated with Microsoft Graph")
                     claims["graph_validation"] = "success"
-                    claims["graph_user_info"] = response.json()
+                    claims["graph_user_info"] = user_info
                 else:
-                    print(f"⚠️  Graph validation failed: {response.status_code}")
+                    logger.warning("Graph validation failed: %s", status_code)
                     claims["graph_validation"] = "failed"
             except Exception as e:
-                print(f"⚠️  Could not validate with Graph: {e}")
+                _record_graph_result(False)
+                logger.warning("Could not validate with Graph: %s", e)
                 claims["graph_validation"] = "error"
         
         # Check scopes/roles if required
@@ -131,19 +230,19 @@ def validate_token_hybrid(token: str, required_scope: Optional[str] = None) -> D
             all_permissions = scopes + roles
             
             if required_scope not in all_permissions:
-                print(f"❌ Missing required scope: {required_scope}")
-                print(f"🔍 Available scopes: {scopes}")
-                print(f"🔍 Available roles: {roles}")
+                logger.warning("Missing required scope: %s", required_scope)
+                logger.debug("Available scopes: %s", scopes)
+                logger.debug("Available roles: %s", roles)
                 raise HTTPException(403, f"Missing required scope or role: {required_scope}")
         
-        print("✅ Hybrid token validation successful")
+        logger.debug("Hybrid token validation successful")
         claims["validation_method"] = "hybrid"
         return claims
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Hybrid validation error: {e}")
+        logger.warning("Hybrid validation error: %s", e)
         raise HTTPException(401, "Token validation failed")
 
 async def simple_auth_dependency(request: Request):
@@ -152,12 +251,12 @@ async def simple_auth_dependency(request: Request):
         credentials = await bearer(request)
         if credentials is None:
             raise HTTPException(401, "No credentials provided")
-        claims = validate_token_with_userinfo(credentials.credentials)
+        claims = await run_in_threadpool(validate_token_with_userinfo, credentials.credentials)
         return claims
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Authentication error: {e}")
+        logger.warning("Authentication error: %s", e)
         raise HTTPException(401, "Authentication failed")
 
 async def hybrid_auth_dependency(request: Request):
@@ -166,10 +265,10 @@ async def hybrid_auth_dependency(request: Request):
         credentials = await bearer(request)
         if credentials is None:
             raise HTTPException(401, "No credentials provided")
-        claims = validate_token_hybrid(credentials.credentials, required_scope=None)
+        claims = await run_in_threadpool(validate_token_hybrid, credentials.credentials, required_scope=None)
         return claims
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Authentication error: {e}")
+        logger.warning("Authentication error: %s", e)
         raise HTTPException(401, "Authentication failed") 
\ No newline at end of file
@@ -1,11 +1,13 @@
 import os
 import time
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
 from jwt import PyJWKClient, decode, InvalidTokenError
 from dotenv import load_dotenv
+from auth_common import SigningKeyCache, VerifiedClaimsCache, check_token_shape, decode_unverified, hash_token
 
 load_dotenv()
 
@@ -24,8 +26,30 @@ if not CLIENT_ID:
 JWKS_URL = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys"
 ISSUER_V2 = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0"
 
-# Initialise JWK client once – thread-safe
-jwk_client = PyJWKClient(JWKS_URL)
+# Initialise JWK client once – thread-safe. Both the JWKS document and the
+# resolved keys are cached for JWKS_CACHE_TTL.
+JWKS_CACHE_TTL = 3600  # seconds
+jwk_client = PyJWKClient(
+    JWKS_URL,
+    cache_keys=True,
+    max_cached_keys=16,
+    cache_jwk_set=True,
+    lifespan=JWKS_CACHE_TTL,
+)
+
+# Signing keys already resolved by kid, so the hot path skips PyJWKClient's
+# header parsing and lock
+_signing_keys = SigningKeyCache(jwk_client, JWKS_CACHE_TTL)
+
+def warm_up() -> bool:
+    """Pre-fetch the JWKS signing keys at startup; errors are reported and swallowed"""
+    return _signing_keys.warm_up()
+
+# Claims of tokens that already passed signature/issuer validation; role
+# checks still run on every call
+VERIFIED_CACHE_TTL = 300  # seconds
+VERIFIED_CACHE_MAX_ENTRIES = 50_000
+_verified_cache = VerifiedClaimsCache(VERIFIED_CACHE_TTL, VERIFIED_CACHE_MAX_ENTRIES)
 
 
 # ---------------------------------------------------------------------------
@@ -34,18 +58,25 @@ jwk_client = PyJWKClient(JWKS_URL)
 
 def _verify_jwt(token: str, required_role: Optional[str] | None = None):
     """Return claims dict after successful validation or raise HTTPException."""
+    check_token_shape(token)
+
+    token_hash = hash_token(token)
+    claims = _verified_cache.get(token_hash)
+    if claims is not None:
+        return _check_role(claims, required_role)
 
     try:
-        # Fetch signing key that matches the token's kid in one network call (cached)
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
+        # Read kid and aud from a single unverified parse of the token
+        header, unverified = decode_unverified(token)
+
+        # Fetch signing key that matches the token's kid (cached)
+        signing_key = _signing_keys.key_for(header.get("kid"))
 
         # Decode & validate signature, issuer and (optionally) audience
         # Audience rules:
         #   – Graph tokens (aud = https://graph.microsoft.com) → verify_aud True
         #   – Custom API tokens  (aud = api://<guid>)          → verify_aud True
         # For Graph tokens we pass the actual aud string that is inside the token.
-        import jwt  # local import to avoid top-level conflicts
-        unverified = jwt.decode(token, options={"verify_signature": False}, algorithms=["RS256"])
         audience_claim = unverified.get("aud")
 
         claims = decode(
@@ -60,19 +91,23 @@ def _verify_jwt(token: str, required_role: Optional[str] | None = None):
         if claims.get("exp", 0) < time.time():
             raise HTTPException(401, "Token expired")
 
-        # Role / scope enforcement (client-credentials tokens carry `roles`)
-        if required_role:
-            token_roles = claims.get("roles", [])
-            if required_role not in token_roles:
-                raise HTTPException(403, f"Missing role: {required_role}")
-
-        return claims
-
     except InvalidTokenError as err:
         # Signature, issuer, audience, or other validation error
         print(f"❌ JWT validation error: {err}")
         raise HTTPException(401, "Invalid token")
 
+    _verified_cache.store(token_hash, claims)
+    return _check_role(claims, required_role)
+
+
+def _check_role(claims: Dict[str, Any], required_role: Optional[str]) -> Dict[str, Any]:
+    """Role / scope enforcement (client-credentials tokens carry `roles`)"""
+    if required_role:
+        token_roles = claims.get("roles", [])
+        if required_role not in token_roles:
+            raise HTTPException(403, f"Missing role: {required_role}")
+    return claims
+
 
 # ---------------------------------------------------------------------------
 # FastAPI dependencies
@@ -83,7 +118,7 @@ async def auth_dependency(request: Request):
     credentials = await bearer_scheme(request)
     if not credentials:
         raise HTTPException(401, "Missing credentials")
-    return _verify_jwt(credentials.credentials, required_role="api.access")
+    return await run_in_threadpool(_verify_jwt, credentials.credentials, required_role="api.access")
 
 
 async def lenient_auth_dependency(request: Request):
@@ -91,7 +126,7 @@ async def lenient_auth_dependency(request: Request):
     credentials = await bearer_scheme(request)
     if not credentials:
         raise HTTPException(401, "Missing credentials")
-    return _verify_jwt(credentials.credentials, required_role=None)
+    return await run_in_threadpool(_verify_jwt, credentials.credentials, required_role=None)
 
 
 async def optional_auth_dependency(request: Request):
@@ -103,6 +138,6 @@ async def optional_auth_dependency(request: Request):
     if not credentials:
         return None
     try:
-        return _verify_jwt(credentials.credentials, required_role=None)
+        return await run_in_threadpool(_verify_jwt, credentials.credentials, required_role=None)
     except HTTPException:
         return None 
\ No newline at end of file
@@ -1,18 +1,21 @@
+import logging
 import os
 import time
-from typing import Optional
-import json
-import base64
-import hashlib
+from typing import Any, Dict, Optional
 
 from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
-from jwt import PyJWKClient, decode, InvalidTokenError
+from jwt import PyJWKClient, decode, get_unverified_header, InvalidTokenError
 from dotenv import load_dotenv
-import jwt
+from auth_common import (
+    SigningKeyCache, VerifiedClaimsCache, check_token_shape, hash_token, normalize_graph_token
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Azure AD tenant & client information
 TENANT_ID: str = os.getenv("AAD_TENANT_ID", "")
 CLIENT_ID: str = os.getenv("AAD_CLIENT_ID", "")
@@ -26,66 +29,51 @@ if not CLIENT_ID:
 ISSUER = f"https://sts.windows.net/{TENANT_ID}/"
 JWKS_URL = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/keys?api-version=1.0"
 
-jwk_client = PyJWKClient(JWKS_URL)
+# Both the JWKS document and the resolved keys are cached for JWKS_CACHE_TTL
+JWKS_CACHE_TTL = 3600  # seconds
+jwk_client = PyJWKClient(
+    JWKS_URL,
+    cache_keys=True,
+    max_cached_keys=16,
+    cache_jwk_set=True,
+    lifespan=JWKS_CACHE_TTL,
+)
+
+# Signing keys already resolved by kid, so the hot path skips PyJWKClient's
+# header parsing and lock
+_signing_keys = SigningKeyCache(jwk_client, JWKS_CACHE_TTL)
+
+def warm_up() -> bool:
+    """Pre-fetch the JWKS signing keys at startup; errors are reported and swallowed"""
+    return _signing_keys.warm_up()
+
+# Claims of tokens that already passed signature/issuer validation; role
+# checks still run on every call
+VERIFIED_CACHE_TTL = 300  # seconds
+VERIFIED_CACHE_MAX_ENTRIES = 50_000
+_verified_cache = VerifiedClaimsCache(VERIFIED_CACHE_TTL, VERIFIED_CACHE_MAX_ENTRIES)
 
 bearer_scheme = HTTPBearer()
 
-# ---------------------------------------------------------------------------
-# Helper: normalise Microsoft Graph tokens (hash 'nonce' header)
-# ---------------------------------------------------------------------------
-
-def _normalize_graph_token(token: str) -> str:
-    """For Microsoft Graph access tokens the 'nonce' header arrives in plain text.
-    Azure AD internally hashes this value before signing, therefore the plain
-    token will always fail signature verification.  The fix is to SHA-256 hash
-    the nonce value, base64-url encode it (without padding) and replace it in
-    the JWT header before running signature validation.
-
-    If the token is already in the correct format (nonce already hashed) we
-    return it unchanged so it is safe to call on any Graph token.
-    """
-    try:
-        header_b64, payload_b64, signature_b64 = token.split(".")
-        # Ensure proper padding for decode
-        padded_header = header_b64 + "=" * (-len(header_b64) % 4)
-        header_json = json.loads(base64.urlsafe_b64decode(padded_header))
-
-        nonce = header_json.get("nonce")
-        if not nonce:
-            return token  # nothing to fix
-
-        # Heuristic: hashed nonce is 43 chars (SHA256 => 32 bytes => 43 base64url chars)
-        if len(nonce) == 43:
-            return token  # already hashed
-
-        # Compute SHA256 hash and base64-url encode (no padding)
-        hashed = hashlib.sha256(nonce.encode()).digest()
-        hashed_b64 = base64.urlsafe_b64encode(hashed).decode().rstrip("=")
-        header_json["nonce"] = hashed_b64
-
-        # Re-encode header
-        new_header_b64 = base64.urlsafe_b64encode(
-            json.dumps(header_json, separators=(",", ":")).encode()
-        ).decode().rstrip("=")
-
-        # Rebuild token
-        return f"{new_header_b64}.{payload_b64}.{signature_b64}"
-    except Exception:
-        # If anything goes wrong fall back to original token; verification may fail later
-        return token
-
 # ---------------------------------------------------------------------------
 # Core verifier
 # ---------------------------------------------------------------------------
 
 def verify_token(token: str, required_role: Optional[str] = None):
     """Verify Azure AD v1.0 access-token and return its claims."""
+    check_token_shape(token)
+    token_hash = hash_token(token)
+    claims = _verified_cache.get(token_hash)
+    if claims is not None:
+        return _check_permission(claims, required_role)
+
     try:
-        # Normalize Microsoft Graph tokens
-        token = _normalize_graph_token(token)
+        # Normalize Microsoft Graph tokens; repeat tokens never get here, the
+        # verified claims cache answers them first
+        token = normalize_graph_token(token)
 
         # Locate signing key by kid
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
+        signing_key = _signing_keys.key_for(get_unverified_header(token).get("kid"))
 
         # Validate signature & issuer (skip audience for app-only Graph token)
         claims = decode(
@@ -100,18 +88,22 @@ def verify_token(token: str, required_role: Optional[str] = None):
         if claims.get("exp", 0) < time.time():
             raise HTTPException(401, "Token expired")
 
-        # Check for required permission in either roles (app-only) or scopes (delegated)
-        if required_role:
-            allowed = set(claims.get("roles", [])) | set(claims.get("scp", "").split())
-            if "api.access" not in allowed and "api.role" not in allowed:
-                raise HTTPException(403, "Missing permission")
-
-        return claims
-
     except InvalidTokenError as err:
-        print(f"❌ JWT validation error: {err}")
+        logger.warning("JWT validation error: %s", err)
         raise HTTPException(401, "Invalid token")
 
+    _verified_cache.store(token_hash, claims)
+    return _check_permission(claims, required_role)
+
+
+def _check_permission(claims: Dict[str, Any], required_role: Optional[str]) -> Dict[str, Any]:
+    """Check for required permission in either roles (app-only) or scopes (delegated)"""
+    if required_role:
+        allowed = set(claims.get("roles", [])) | set(claims.get("scp", "").split())
+        if "api.access" not in allowed and "api.role" not in allowed:
+            raise HTTPException(403, "Missing permission")
+    return claims
+
 # ---------------------------------------------------------------------------
 # FastAPI dependencies
 # ---------------------------------------------------------------------------
@@ -120,14 +112,14 @@ async def auth_dependency(request: Request):
     credentials = await bearer_scheme(request)
     if credentials is None:
         raise HTTPException(401, "No credentials provided")
-    return verify_token(credentials.credentials, required_role="api.access")
+    return await run_in_threadpool(verify_token, credentials.credentials, required_role="api.access")
 
 
 async def lenient_auth_dependency(request: Request):
     credentials = await bearer_scheme(request)
     if credentials is None:
         raise HTTPException(401, "No credentials provided")
-    return verify_token(credentials.credentials)
+    return await run_in_threadpool(verify_token, credentials.credentials)
 
 
 async def optional_auth_dependency(request: Request):
@@ -138,6 +130,6 @@ async def optional_auth_dependency(request: Request):
     if credentials is None:
         return None
     try:
-        return verify_token(credentials.credentials)
+        return await run_in_threadpool(verify_token, credentials.credentials)
     except HTTPException:
         return None
\ No newline at end of file
@@ -1,19 +1,55 @@
 import azure.functions as func
-import json
 import logging
 import os
-import requests
-from typing import Dict, List
+import re
+import tempfile
+import threading
+import httpx
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import ContainerClient
 
 # Import your existing modules
 from graph_client import graph_client
 from ingest_local import extract_text, chunk_text
-from embedding import embed_text
-from azure_search_client import get_search_client
+from embedding import embed_texts
+from azure_search_client import get_search_client, upload_documents_in_batches
 
 # Configuration
 WEBHOOK_CLIENT_STATE = os.getenv("WEBHOOK_CLIENT_STATE", "docusense-webhook-secret")
+INGEST_WORKERS = 8  # files downloaded/embedded/indexed concurrently per delta batch
+DRIVE_WORKERS = 4  # drives whose delta is processed concurrently per notification batch
+SUPPORTED_EXTENSIONS = frozenset({'.pdf', '.docx', '.pptx', '.txt'})
+# Multi-tenant client state format: docusense-{tenant_id}-webhook
+CLIENT_STATE_RE = re.compile(r"docusense-(.+)-webhook")
+# Last @odata.deltaLink per drive, so each delta query resumes where the previous one stopped.
+# Kept as one blob per drive in the Function App's storage account, so every instance
+# shares them and they survive redeploys (wwwroot is read-only under run-from-package).
+# Without a storage connection (local runs) they fall back to a JSON file in a
+# writable location, which only this machine sees.
+DELTA_LINKS_CONNECTION = os.getenv("DELTA_LINKS_STORAGE_CONNECTION") or os.getenv("AzureWebJobsStorage")
+DELTA_LINKS_CONTAINER = os.getenv("DELTA_LINKS_CONTAINER", "delta-links")
+DELTA_LINKS_FILE = os.getenv("DELTA_LINKS_FILE", os.path.join(tempfile.gettempdir(), "docusense_delta_links.json"))
+_delta_links_lock = threading.Lock()
+ACCEPTED_BODY = orjson.dumps({"status": "accepted"})
+# Only the fields process_drive_delta reads, to keep delta pages small
+DELTA_PARAMS = {"$select": "id,name,size,lastModifiedDateTime,webUrl,file,deleted"}
+
+# Shared HTTP client so Graph calls reuse warm keep-alive connections across
+# invocations handled by the same worker, instead of a new TCP+TLS handshake each time
+_graph_http = httpx.Client(
+    transport=httpx.HTTPTransport(
+        retries=3,  # connection failures only
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    ),
+    timeout=10,
+    headers={"User-Agent": "docusense-webhook"},
+)
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     """Azure Function HTTP trigger for Microsoft Graph webhooks"""
@@ -33,7 +69,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         
         # Parse notification body
         try:
-            req_body = req.get_json()
+            req_body = orjson.loads(req.get_body())
         except ValueError:
             logging.error('Invalid JSON in request body')
             return func.HttpResponse("Invalid JSON", status_code=400)
@@ -47,21 +83,14 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         for notification in notifications:
             client_state = notification.get("clientState")
             
-            # Support both single-tenant and multi-tenant client states
-            valid_client_states = [
-                WEBHOOK_CLIENT_STATE,  # Original format
-                # Multi-tenant format: docusense-{tenant_id}-webhook
-            ]
-            
-            # Check if it's a multi-tenant client state
+            # Support both the single-tenant client state and the multi-tenant format
             is_valid = False
             tenant_id = None
             
             if client_state == WEBHOOK_CLIENT_STATE:
                 is_valid = True
-            elif client_state and client_state.startswith("docusense-") and client_state.endswith("-webhook"):
-                # Extract tenant ID from client state
-                tenant_id = client_state[10:-8]  # Remove "docusense-" and "-webhook"
+            elif client_state and (match := CLIENT_STATE_RE.fullmatch(client_state)):
+                tenant_id = match.group(1)
                 is_valid = True
             
             if not is_valid:
@@ -72,12 +101,17 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             if tenant_id:
                 notification["tenant_id"] = tenant_id
         
-        # Process notifications
-        for notification in notifications:
-            process_notification(notification)
+        # Graph sends one notification per change, often many for the same drive;
+        # a single delta query per drive picks all of them up
+        drive_ids = list(dict.fromkeys(
+            drive_id for drive_id in map(drive_id_for_notification, notifications) if drive_id
+        ))
+        if drive_ids:
+            with ThreadPoolExecutor(max_workers=min(DRIVE_WORKERS, len(drive_ids))) as executor:
+                list(executor.map(process_drive_delta, drive_ids))
         
         return func.HttpResponse(
-            json.dumps({"status": "accepted"}),
+            ACCEPTED_BODY,
             status_code=200,
             headers={"Content-Type": "application/json"}
         )
@@ -86,8 +120,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         logging.error(f'Error processing webhook: {str(e)}')
         return func.HttpResponse("Internal error", status_code=500)
 
-def process_notification(notification: Dict):
-    """Process a single Graph notification"""
+def drive_id_for_notification(notification: Dict) -> Optional[str]:
+    """Return the drive a Graph notification refers to, or None if it isn't a drive resource"""
     
     try:
         resource = notification.get("resource", "")
@@ -97,14 +131,65 @@ def process_notification(notification: Dict):
         
         # Extract drive ID from resource
         if "/drives/" in resource:
-            parts = resource.split("/")
-            drive_id = parts[2]
-            
-            # Use delta query to get actual changes
-            process_drive_delta(drive_id)
+            return resource.split("/")[2]
         
     except Exception as e:
         logging.error(f'Error processing notification: {str(e)}')
+    return None
+
+@lru_cache(maxsize=None)
+def get_delta_links_container() -> Optional[ContainerClient]:
+    """Blob container holding the saved deltaLinks, or None to use DELTA_LINKS_FILE"""
+    if not DELTA_LINKS_CONNECTION:
+        return None
+    container = ContainerClient.from_connection_string(DELTA_LINKS_CONNECTION, DELTA_LINKS_CONTAINER)
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+    return container
+
+def get_saved_delta_link(drive_id: str) -> Optional[str]:
+    """Return the deltaLink saved for a drive by the previous delta query, if any"""
+    try:
+        container = get_delta_links_container()
+        if container:
+            return container.download_blob(drive_id).readall().decode("utf-8")
+        with open(DELTA_LINKS_FILE, "rb") as f:
+            return orjson.loads(f.read()).get(drive_id)
+    except (OSError, ValueError, ResourceNotFoundError):
+        return None
+    except Exception as e:
+        logging.warning(f'Could not read delta link for drive {drive_id}: {str(e)}')
+        return None
+
+def save_delta_link(drive_id: str, delta_link: str):
+    """Remember a drive's deltaLink so the next delta query only returns newer changes"""
+    try:
+        container = get_delta_links_container()
+        if container:
+            container.upload_blob(drive_id, delta_link.encode("utf-8"), overwrite=True)
+            return
+    except Exception as e:
+        logging.error(f'Could not save delta link for drive {drive_id}: {str(e)}')
+        return
+    
+    with _delta_links_lock:
+        try:
+            with open(DELTA_LINKS_FILE, "rb") as f:
+                delta_links = orjson.loads(f.read())
+        except (OSError, ValueError):
+            delta_links = {}
+        delta_links[drive_id] = delta_link
+        
+        # Write to a temp file and swap it in, so a crash never leaves a torn file
+        tmp_path = f"{DELTA_LINKS_FILE}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps(delta_links))
+            os.replace(tmp_path, DELTA_LINKS_FILE)
+        except OSError as e:
+            logging.error(f'Could not save delta link for drive {drive_id}: {str(e)}')
 
 def process_drive_delta(drive_id: str):
     """Process delta changes for a drive"""
@@ -112,46 +197,88 @@ def process_drive_delta(drive_id: str):
     try:
         headers = graph_client.get_headers()
         
-        # Get delta changes
-        delta_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root/delta"
-        params = {
-            "$select": "id,name,size,lastModifiedDateTime,webUrl,file,deleted"
-        }
+        # Resume from the deltaLink saved last time so Graph only returns what
+        # changed since then; without one, enumerate the drive from scratch
+        root_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root/delta"
+        saved_link = get_saved_delta_link(drive_id)
+        delta_url, params = (saved_link, None) if saved_link else (root_url, DELTA_PARAMS)
         
-        response = requests.get(delta_url, headers=headers, params=params)
+        changes = []
+        delta_link = None
+        while delta_url:
+            response = _graph_http.get(delta_url, headers=headers, params=params)
+            
+            if response.status_code == 410 and saved_link:
+                # The saved token expired (resyncRequired); start over from the root
+                logging.warning(f'Delta link for drive {drive_id} expired, resyncing')
+                saved_link = None
+                delta_url, params = root_url, DELTA_PARAMS
+                changes = []
+                continue
+            
+            if response.status_code != 200:
+                break
+            
+            data = orjson.loads(response.content)
+            changes.extend(data.get("value", []))
+            # Follow nextLink pages until Graph hands out the deltaLink for next time
+            delta_url = data.get("@odata.nextLink")
+            delta_link = data.get("@odata.deltaLink")
+            params = None  # next/delta links already carry the query
         
         if response.status_code == 200:
-            data = response.json()
-            changes = data.get("value", [])
-            
             logging.info(f'Processing {len(changes)} delta changes')
             
+            # Only the latest change per item matters; e.g. a delete followed by
+            # a re-create is just an ingest (which replaces the old chunks anyway)
+            latest = {}
             for item in changes:
+                latest.pop(item.get("id"), None)
+                latest[item.get("id")] = item
+            
+            to_ingest = []
+            all_succeeded = True
+            for item_id, item in latest.items():
                 if "deleted" in item:
                     # File was deleted
-                    item_id = item.get("id")
-                    remove_file_from_index(drive_id, item_id)
+                    all_succeeded &= remove_file_from_index(drive_id, item_id)
                 elif "file" in item:
                     # File was created or updated
-                    item_id = item.get("id")
                     file_name = item.get("name", "Unknown")
                     
                     # Check if supported file type
                     file_ext = os.path.splitext(file_name)[1].lower()
-                    supported_extensions = {'.pdf', '.docx', '.pptx', '.txt'}
                     
-                    if file_ext in supported_extensions:
-                        ingest_single_file(drive_id, item_id, file_name)
+                    if file_ext in SUPPORTED_EXTENSIONS:
+                        to_ingest.append((item_id, file_name))
                     else:
                         logging.info(f'Skipping unsupported file type: {file_name}')
+            
+            # Each ingest is download -> extract -> embed -> index round-trips,
+            # so run them side by side
+            if to_ingest:
+                with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(to_ingest))) as executor:
+                    futures = [
+                        executor.submit(ingest_single_file, drive_id, item_id, file_name)
+                        for item_id, file_name in to_ingest
+                    ]
+                    for future in as_completed(futures):
+                        all_succeeded &= future.result()  # ingest_single_file logs its own errors
+            
+            # Only move past these changes once they are all in the index;
+            # otherwise the next notification replays them from the old link
+            if delta_link and all_succeeded:
+                save_delta_link(drive_id, delta_link)
+            elif delta_link:
+                logging.warning(f'Some changes for drive {drive_id} failed; keeping the previous delta link')
         else:
             logging.error(f'Delta query failed: {response.status_code} - {response.text}')
             
     except Exception as e:
         logging.error(f'Error processing drive delta: {str(e)}')
 
-def ingest_single_file(drive_id: str, item_id: str, file_name: str):
-    """Ingest a single file"""
+def ingest_single_file(drive_id: str, item_id: str, file_name: str) -> bool:
+    """Ingest a single file; returns False if it could not be indexed"""
     
     try:
         logging.info(f'Ingesting file: {file_name}')
@@ -160,63 +287,68 @@ def ingest_single_file(drive_id: str, item_id: str, file_name: str):
         temp_path = graph_client.download_file(drive_id, item_id)
         if not temp_path:
             logging.error(f'Failed to download {file_name}')
-            return
+            return False
         
-        # Extract text
-        content = extract_text(temp_path)
+        # Extract text; the download isn't needed after that, so remove it
+        # straight away, even if extraction fails
+        try:
+            content = extract_text(temp_path, file_name)
+        finally:
+            Path(temp_path).unlink(missing_ok=True)
         if not content.strip():
             logging.warning(f'No text extracted from {file_name}')
-            os.unlink(temp_path)
-            return
+            return True
         
         # Remove existing chunks for this file
-        remove_file_from_index(drive_id, item_id)
+        if not remove_file_from_index(drive_id, item_id):
+            return False
         
         # Create new chunks and embeddings
         search_client = get_search_client()
-        docs = []
-        
-        for snippet, chunk_idx in chunk_text(content):
-            try:
-                embedding = embed_text(snippet)
-                
-                doc = {
-                    "id": f"{drive_id}_{item_id}_{chunk_idx}",
-                    "title": file_name,
-                    "content": snippet,
-                    "chunk": chunk_idx,
-                    "vector": embedding,
-                    "source_drive_id": drive_id,
-                    "source_item_id": item_id,
-                    "last_modified": datetime.utcnow().isoformat()
-                }
-                
-                docs.append(doc)
-                
-            except Exception as e:
-                logging.error(f'Error processing chunk from {file_name}: {str(e)}')
-        
-        # Upload to search index
+        chunks = list(chunk_text(content))
+        
+        # One embeddings request per batch of chunks rather than one per chunk
+        embeddings = embed_texts([snippet for snippet, _ in chunks])
+        
+        # Every chunk of the file shares one ingestion timestamp
+        indexed_at = datetime.utcnow().isoformat()
+        
+        docs = [
+            {
+                "id": f"{drive_id}_{item_id}_{chunk_idx}",
+                "title": file_name,
+                "content": snippet,
+                "chunk": chunk_idx,
+                "vector": embedding,
+                "source_drive_id": drive_id,
+                "source_item_id": item_id,
+                "last_modified": indexed_at
+            }
+            for (snippet, chunk_idx), embedding in zip(chunks, embeddings)
+        ]
+        
+        # Upload to search index, split to stay under the per-request limits
         if docs:
-            search_client.upload_documents(documents=docs)
+            upload_documents_in_batches(search_client, docs)
             logging.info(f'Indexed {len(docs)} chunks from {file_name}')
-        
-        # Clean up temp file
-        os.unlink(temp_path)
+        return True
         
     except Exception as e:
         logging.error(f'Error ingesting file {item_id}: {str(e)}')
+        return False
 
-def remove_file_from_index(drive_id: str, item_id: str):
-    """Remove all chunks for a deleted file from the search index"""
+def remove_file_from_index(drive_id: str, item_id: str) -> bool:
+    """Remove all chunks for a deleted file from the search index; returns False on error"""
     
     try:
         search_client = get_search_client()
         
-        # Search for all documents from this file
+        # Filter-only query: no search text means no full-text evaluation or scoring
         results = search_client.search(
-            search_text="*",
-            filter=f"source_drive_id eq '{drive_id}' and source_item_id eq '{item_id}'"
+            search_text=None,
+            filter=f"source_drive_id eq '{drive_id}' and source_item_id eq '{item_id}'",
+            select=["id"],  # ids are all we need, not full documents
+            top=10000  # Get all chunks
         )
         
         # Delete all chunks
@@ -224,6 +356,8 @@ def remove_file_from_index(drive_id: str, item_id: str):
         if doc_ids:
             search_client.delete_documents(documents=[{"id": doc_id} for doc_id in doc_ids])
             logging.info(f'Removed {len(doc_ids)} chunks from search index')
+        return True
             
     except Exception as e:
-        logging.error(f'Error removing file from index: {str(e)}') 
\ No newline at end of file
+        logging.error(f'Error removing file from index: {str(e)}')
+        return False 
\ No newline at end of file
@@ -1,16 +1,26 @@
 import azure.functions as func
-import json
 import logging
 import os
+import re
+import sys
+import threading
+import time
+import ijson
+import orjson
 import requests
-from typing import Dict, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from azure.servicebus import ServiceBusClient, ServiceBusMessage
 from datetime import datetime
 
 # Import your existing modules
 from graph_client import graph_client
 from ingest_local import extract_text, chunk_text
-from embedding import embed_text
-from azure_search_client import get_search_client
+from embedding import embed_texts
+from azure_search_client import get_search_client, upload_documents_in_batches
 from large_file_handler import ingest_file_with_size_handling, can_process_file_size
 from queue_based_processor import should_use_queue_processing, enqueue_large_file_processing
 from file_type_filter import should_process_file, log_file_decision, get_estimated_processing_cost
@@ -18,6 +28,25 @@ from telemetry import logger, track_performance, log_info, log_error
 
 # Configuration
 WEBHOOK_CLIENT_STATE = os.getenv("WEBHOOK_CLIENT_STATE", "docusense-webhook-secret")
+SERVICE_BUS_CONNECTION_STRING = os.getenv("SERVICE_BUS_CONNECTION_STRING")
+DELTA_QUEUE_NAME = "drive-delta-processing"  # consumed by the delta-processor function
+DELTA_WORKERS = 8  # delta changes processed concurrently per drive
+DELTA_MAX_IN_FLIGHT = DELTA_WORKERS * 2  # changes parsed but not yet processed, per drive
+# Multi-tenant client state format: docusense-{tenant_id}-webhook
+CLIENT_STATE_RE = re.compile(r"docusense-(.+)-webhook")
+REMOVE_BATCH_SIZE = 1000  # max documents per Azure Search indexing request
+# Get delta changes with specific fields to minimize response size
+DELTA_PARAMS = {"$select": "id,name,size,lastModifiedDateTime,webUrl,file,deleted,parentReference"}
+
+# Shared Graph session so delta queries reuse pooled keep-alive connections
+# across invocations handled by the same worker, instead of a new TCP+TLS
+# handshake per notification
+_graph_session = requests.Session()
+_graph_session.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"], raise_on_status=False),
+))
 
 @track_performance("webhook_processing")
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -39,7 +68,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         
         # Parse notification body
         try:
-            req_body = req.get_json()
+            req_body = orjson.loads(req.get_body())
         except ValueError:
             logging.error('Invalid JSON in request body')
             return func.HttpResponse("Invalid JSON", status_code=400)
@@ -56,7 +85,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         
         logging.info(f'Processing {len(notifications)} notifications')
         
-        # Validate and process each notification
+        # Validate every notification before acting on any of them
         for notification in notifications:
             # ChatGPT: Critical clientState validation
             client_state = notification.get("clientState")
@@ -71,13 +100,26 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             
             # Log webhook event with telemetry
             logger.log_webhook_event("notification_received", notification)
-            
-            # ChatGPT: Use queue-based processing for robustness
-            # For now, process directly but structure for queue migration
-            process_notification_sync(notification)
+        
+        drives = drives_to_process(notifications)
+        
+        # ChatGPT: Use queue-based processing for robustness
+        # Graph wants an answer within seconds, so hand the delta work to the
+        # queue-triggered function and acknowledge straight away
+        if enqueue_drives_for_processing(drives):
+            return func.HttpResponse(
+                orjson.dumps({"status": "accepted", "queued": len(drives)}),
+                status_code=202,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # No queue configured (e.g. local development) or it is unavailable: process inline
+        for drive_id, tenant_id in drives:
+            # ChatGPT: Call delta API to get actual changes
+            process_drive_delta(drive_id, tenant_id)
         
         return func.HttpResponse(
-            json.dumps({"status": "accepted", "processed": len(notifications)}),
+            orjson.dumps({"status": "accepted", "processed": len(notifications)}),
             status_code=200,
             headers={"Content-Type": "application/json"}
         )
@@ -86,6 +128,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         logging.error(f'Error processing webhook: {str(e)}')
         return func.HttpResponse("Internal error", status_code=500)
 
+@lru_cache(maxsize=128)  # a batch usually repeats the same few client states
 def validate_client_state(client_state: str) -> str:
     """
     Validate client state and extract tenant ID if multi-tenant format
@@ -98,20 +141,18 @@ def validate_client_state(client_state: str) -> str:
     if client_state == WEBHOOK_CLIENT_STATE:
         return "default"
     
-    # Multi-tenant format: docusense-{tenant_id}-webhook
-    if client_state.startswith("docusense-") and client_state.endswith("-webhook"):
-        tenant_id = client_state[10:-8]  # Extract tenant ID
-        if tenant_id:  # Ensure tenant ID is not empty
-            return tenant_id
-    
-    return None
+    # Multi-tenant format: docusense-{tenant_id}-webhook, with a non-empty tenant ID
+    match = CLIENT_STATE_RE.fullmatch(client_state)
+    return match.group(1) if match else None
 
-def process_notification_sync(notification: Dict):
+def drives_to_process(notifications: List[Dict]) -> List[Tuple[str, str]]:
     """
-    Process a single Graph notification synchronously
-    ChatGPT: Structure this for easy migration to queue-based processing
+    Return the distinct (drive_id, tenant_id) pairs a notification batch refers to.
+    Graph sends one notification per change, often many for the same drive, and
+    a single delta query per drive picks all of them up.
     """
-    try:
+    drives = {}
+    for notification in notifications:
         resource = notification.get("resource", "")
         change_type = notification.get("changeType", "")
         tenant_id = notification.get("tenant_id", "default")
@@ -122,58 +163,91 @@ def process_notification_sync(notification: Dict):
         if "/drives/" in resource:
             parts = resource.split("/")
             if len(parts) >= 3:
-                drive_id = parts[2]
-                
-                # ChatGPT: Call delta API to get actual changes
-                process_drive_delta(drive_id, tenant_id)
+                drives[(parts[2], tenant_id)] = None
             else:
                 logging.error(f'Invalid resource path format: {resource}')
         else:
             logging.warning(f'Unsupported resource type: {resource}')
-        
-    except Exception as e:
-        logging.error(f'Error processing notification: {str(e)}')
+    
+    return list(drives)
 
 def process_drive_delta(drive_id: str, tenant_id: str):
     """
     ChatGPT: Use delta query to get actual file changes
     Process changes and handle large files within memory limits
     """
+    # Every idempotency cache key for this drive holds these two strings; intern
+    # them so entries from different runs share one copy and compare by identity
+    drive_id, tenant_id = sys.intern(drive_id), sys.intern(tenant_id)
+    
     try:
         headers = graph_client.get_headers()
         
-        # Get delta changes with specific fields to minimize response size
-        delta_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root/delta"
-        params = {
-            "$select": "id,name,size,lastModifiedDateTime,webUrl,file,deleted,parentReference"
-        }
-        
-        response = requests.get(delta_url, headers=headers, params=params)
+        # Items are handed to the workers as each page arrives, so Graph paging
+        # and the per-item download/index round-trips overlap. Parsing pauses
+        # while DELTA_MAX_IN_FLIGHT items are queued, so only that many change
+        # dicts (and their futures) are held at once however long the delta is.
+        processed = 0
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=DELTA_WORKERS) as executor:
+            for item in iter_delta_changes(drive_id, headers):
+                if len(in_flight) >= DELTA_MAX_IN_FLIGHT:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    processed += len(done)
+                in_flight.add(executor.submit(process_item_change_safely, item, drive_id, tenant_id))
+            processed += len(wait(in_flight).done)
         
-        if response.status_code == 200:
-            data = response.json()
-            changes = data.get("value", [])
-            
-            logging.info(f'Processing {len(changes)} delta changes for tenant {tenant_id}')
-            
-            for item in changes:
-                try:
-                    process_single_item_change(item, drive_id, tenant_id)
-                except Exception as e:
-                    logging.error(f'Error processing item {item.get("id", "unknown")}: {str(e)}')
-                    # Continue processing other items
-            
-            # Handle pagination if needed
-            next_link = data.get("@odata.nextLink")
-            if next_link:
-                logging.info(f'Delta query has more pages, consider implementing pagination')
-                
-        else:
-            logging.error(f'Delta query failed: {response.status_code} - {response.text}')
+        logging.info(f'Processed {processed} delta changes for tenant {tenant_id}')
             
     except Exception as e:
         logging.error(f'Error processing drive delta: {str(e)}')
 
+def iter_delta_changes(drive_id: str, headers: Dict):
+    """Yield every change from a drive's delta query, following @odata.nextLink pages"""
+    delta_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root/delta"
+    params = DELTA_PARAMS
+    
+    while delta_url:
+        links = {}
+        with _graph_session.get(delta_url, headers=headers, params=params, timeout=(3, 30), stream=True) as response:
+            if response.status_code != 200:
+                logging.error(f'Delta query failed: {response.status_code} - {response.text}')
+                return
+            
+            # Parse the page incrementally so each change can be dispatched
+            # while the rest of the page is still downloading
+            response.raw.decode_content = True
+            yield from _iter_delta_page(response.raw, links)
+        
+        delta_url = links.get("@odata.nextLink")
+        params = None  # nextLink already carries the query
+
+def _iter_delta_page(stream, links: Dict):
+    """
+    Yield the items of one delta page from a byte stream as they are parsed.
+    Top-level @odata links (nextLink/deltaLink) are stored in `links`, since
+    Graph may send them after the value array.
+    """
+    builder = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == "value.item" and event == "end_map":
+                yield builder.value
+                builder = None
+        elif prefix == "value.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix in ("@odata.nextLink", "@odata.deltaLink") and event == "string":
+            links[prefix] = value
+
+def process_item_change_safely(item: Dict, drive_id: str, tenant_id: str):
+    """process_single_item_change that logs errors instead of raising, so one bad item doesn't stop the rest"""
+    try:
+        process_single_item_change(item, drive_id, tenant_id)
+    except Exception as e:
+        logging.error(f'Error processing item {item.get("id", "unknown")}: {str(e)}')
+
 def process_single_item_change(item: Dict, drive_id: str, tenant_id: str):
     """Process a single file change from delta query"""
     
@@ -218,65 +292,77 @@ def process_single_item_change(item: Dict, drive_id: str, tenant_id: str):
             return
         
         # File type already checked above, proceed with processing
-            # Check idempotency
-            if not is_already_processed(drive_id, item_id, last_modified, tenant_id):
-                # Prepare file metadata for telemetry
-                file_meta = {
-                    "file_name": file_name,
-                    "file_size": file_size,
-                    "tenant_id": tenant_id,
-                    "drive_id": drive_id,
-                    "item_id": item_id,
-                    "processing_method": method,
-                    "estimated_cost": get_estimated_processing_cost(file_size, file_name.split('.')[-1] if '.' in file_name else 'unknown')
-                }
-                
-                log_info(f'Processing file: {file_name} ({method} method, tenant: {tenant_id})')
-                
-                start_time = time.time()
-                success = ingest_file_with_size_handling(drive_id, item_id, file_name, file_size, tenant_id)
-                duration_ms = (time.time() - start_time) * 1000
-                
-                if success:
-                    mark_as_processed(drive_id, item_id, last_modified, tenant_id)
-                    logger.log_file_processing("file_indexed", file_meta, duration_ms)
-                else:
-                    logger.log_file_processing("file_failed", file_meta, duration_ms, error=Exception("Processing failed"))
+        # Check idempotency
+        if not is_already_processed(drive_id, item_id, last_modified, tenant_id):
+            # Prepare file metadata for telemetry
+            file_meta = {
+                "file_name": file_name,
+                "file_size": file_size,
+                "tenant_id": tenant_id,
+                "drive_id": drive_id,
+                "item_id": item_id,
+                "processing_method": method,
+                "estimated_cost": get_estimated_processing_cost(file_size, file_name.split('.')[-1] if '.' in file_name else 'unknown')
+            }
+            
+            log_info(f'Processing file: {file_name} ({method} method, tenant: {tenant_id})')
+            
+            start_time = time.time()
+            success = ingest_file_with_size_handling(drive_id, item_id, file_name, file_size, tenant_id)
+            duration_ms = (time.time() - start_time) * 1000
+            
+            if success:
+                mark_as_processed(drive_id, item_id, last_modified, tenant_id)
+                logger.log_file_processing("file_indexed", file_meta, duration_ms)
             else:
-                log_info(f'File {file_name} already processed, skipping')
+                logger.log_file_processing("file_failed", file_meta, duration_ms, error=Exception("Processing failed"))
+        else:
+            log_info(f'File {file_name} already processed, skipping')
 
 # ChatGPT: Idempotency cache (production should use Redis/database)
+# (tenant_id, drive_id, item_id) -> (expires_at, last_modified), bounded so a
+# long-lived worker doesn't keep one entry per file it has ever seen
+PROCESSED_CACHE_TTL = 24 * 3600  # seconds
+PROCESSED_CACHE_MAX_ENTRIES = 200_000
 processed_files_cache = {}
+processed_files_lock = threading.Lock()  # delta changes are processed on several threads
 
 def is_already_processed(drive_id: str, item_id: str, last_modified: str, tenant_id: str) -> bool:
     """Check if file version was already processed (idempotency)"""
-    cache_key = f"{tenant_id}_{drive_id}_{item_id}"
-    cached_timestamp = processed_files_cache.get(cache_key)
-    return cached_timestamp == last_modified
+    with processed_files_lock:
+        cached = processed_files_cache.get((tenant_id, drive_id, item_id))
+    return cached is not None and cached[0] > time.monotonic() and cached[1] == last_modified
 
 def mark_as_processed(drive_id: str, item_id: str, last_modified: str, tenant_id: str):
     """Mark file version as processed"""
-    cache_key = f"{tenant_id}_{drive_id}_{item_id}"
-    processed_files_cache[cache_key] = last_modified
+    now = time.monotonic()
+    with processed_files_lock:
+        if len(processed_files_cache) >= PROCESSED_CACHE_MAX_ENTRIES:
+            # Drop expired entries; if that isn't enough, drop the oldest half
+            for key in [key for key, (expires_at, _) in processed_files_cache.items() if expires_at <= now]:
+                del processed_files_cache[key]
+            if len(processed_files_cache) >= PROCESSED_CACHE_MAX_ENTRIES:
+                for key in list(processed_files_cache)[:PROCESSED_CACHE_MAX_ENTRIES // 2]:
+                    del processed_files_cache[key]
+        processed_files_cache[(tenant_id, drive_id, item_id)] = (now + PROCESSED_CACHE_TTL, last_modified)
 
 def ingest_single_file(drive_id: str, item_id: str, file_name: str, tenant_id: str):
     """
     Ingest a single file with tenant context
     ChatGPT: Stream download to /tmp for large files
     """
-    temp_path = None
-    
     try:
         logging.info(f'Ingesting file: {file_name} (tenant: {tenant_id})')
         
-        # Download file to temporary location
-        temp_path = graph_client.download_file(drive_id, item_id)
-        if not temp_path:
+        # Download into memory (spilling to /tmp only for big files)
+        download = graph_client.download_file_spooled(drive_id, item_id)
+        if not download:
             logging.error(f'Failed to download {file_name}')
             return
         
-        # Extract text content
-        content = extract_text(temp_path)
+        # Extract text content; closing the download frees it either way
+        with download:
+            content = extract_text(download, file_name)
         if not content.strip():
             logging.warning(f'No text extracted from {file_name}')
             return
@@ -286,45 +372,37 @@ def ingest_single_file(drive_id: str, item_id: str, file_name: str, tenant_id: s
         
         # Create new chunks and embeddings
         search_client = get_search_client()
-        docs = []
-        
-        for snippet, chunk_idx in chunk_text(content):
-            try:
-                embedding = embed_text(snippet)
-                
-                # Include tenant context in document
-                doc = {
-                    "id": f"{tenant_id}_{drive_id}_{item_id}_{chunk_idx}",
-                    "title": file_name,
-                    "content": snippet,
-                    "chunk": chunk_idx,
-                    "vector": embedding,
-                    "source_drive_id": drive_id,
-                    "source_item_id": item_id,
-                    "tenant_id": tenant_id,
-                    "last_modified": datetime.utcnow().isoformat()
-                }
-                
-                docs.append(doc)
-                
-            except Exception as e:
-                logging.error(f'Error processing chunk from {file_name}: {str(e)}')
-        
-        # Upload to search index
+        chunks = list(chunk_text(content))
+        
+        # One embeddings request per batch of chunks rather than one per chunk
+        embeddings = embed_texts([snippet for snippet, _ in chunks])
+        
+        # Every chunk of the file shares one ingestion timestamp
+        indexed_at = datetime.utcnow().isoformat()
+        
+        # Include tenant context in document
+        docs = [
+            {
+                "id": f"{tenant_id}_{drive_id}_{item_id}_{chunk_idx}",
+                "title": file_name,
+                "content": snippet,
+                "chunk": chunk_idx,
+                "vector": embedding,
+                "source_drive_id": drive_id,
+                "source_item_id": item_id,
+                "tenant_id": tenant_id,
+                "last_modified": indexed_at
+            }
+            for (snippet, chunk_idx), embedding in zip(chunks, embeddings)
+        ]
+        
+        # Upload to search index, split to stay under the per-request limits
         if docs:
-            search_client.upload_documents(documents=docs)
+            upload_documents_in_batches(search_client, docs)
             logging.info(f'Indexed {len(docs)} chunks from {file_name} (tenant: {tenant_id})')
         
     except Exception as e:
         logging.error(f'Error ingesting file {item_id}: {str(e)}')
-    
-    finally:
-        # Clean up temp file
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                logging.warning(f'Failed to clean up temp file {temp_path}: {str(e)}')
 
 def remove_file_from_index(drive_id: str, item_id: str, tenant_id: str):
     """Remove all chunks for a deleted file from the search index"""
@@ -335,37 +413,60 @@ def remove_file_from_index(drive_id: str, item_id: str, tenant_id: str):
         # Search for all documents from this file for this tenant
         filter_query = f"source_drive_id eq '{drive_id}' and source_item_id eq '{item_id}' and tenant_id eq '{tenant_id}'"
         
+        # Filter-only query (no text to evaluate or score) returning just the ids
         results = search_client.search(
-            search_text="*",
-            filter=filter_query
+            search_text=None,
+            filter=filter_query,
+            select=["id"]
         )
         
-        # Delete all chunks
+        # Collect every id before deleting, so deletes can't shift the result pages
         doc_ids = [doc["id"] for doc in results]
+        
+        # Delete all chunks, REMOVE_BATCH_SIZE keys per indexing request
+        for start in range(0, len(doc_ids), REMOVE_BATCH_SIZE):
+            batch = doc_ids[start:start + REMOVE_BATCH_SIZE]
+            search_client.delete_documents(documents=[{"id": doc_id} for doc_id in batch])
         if doc_ids:
-            search_client.delete_documents(documents=[{"id": doc_id} for doc_id in doc_ids])
             logging.info(f'Removed {len(doc_ids)} chunks from search index (tenant: {tenant_id})')
             
     except Exception as e:
         logging.error(f'Error removing file from index: {str(e)}')
 
-# ChatGPT: Future enhancement - Queue-based processing
-def enqueue_notification_for_processing(notification: Dict):
+# ChatGPT: Queue-based processing
+def enqueue_drives_for_processing(drives: List[Tuple[str, str]]) -> bool:
     """
-    Future enhancement: Enqueue notification for async processing
-    This would use Azure Service Bus or Storage Queue
+    Enqueue one message per (drive_id, tenant_id) for the queue-triggered delta
+    processor. Returns False if nothing could be enqueued (no queue configured,
+    or sending failed) so the caller can fall back to processing inline.
     """
-    # Example implementation:
-    # queue_client = ServiceBusClient.from_connection_string(connection_string)
-    # queue_client.send_message(json.dumps(notification))
-    pass
+    if not SERVICE_BUS_CONNECTION_STRING:
+        return False
+    
+    if not drives:
+        return True  # nothing to process
+    
+    try:
+        queued_at = datetime.utcnow().isoformat()
+        messages = [
+            ServiceBusMessage(orjson.dumps({"drive_id": drive_id, "tenant_id": tenant_id, "queued_at": queued_at}))
+            for drive_id, tenant_id in drives
+        ]
+        with ServiceBusClient.from_connection_string(SERVICE_BUS_CONNECTION_STRING) as client:
+            with client.get_queue_sender(queue_name=DELTA_QUEUE_NAME) as sender:
+                sender.send_messages(messages)
+        
+        logging.info(f'Enqueued delta processing for {len(messages)} drives')
+        return True
+        
+    except Exception as e:
+        logging.error(f'Error enqueueing notifications: {str(e)}')
+        return False
 
 def process_notification_from_queue(queue_message: str):
     """
-    Future enhancement: Process notification from queue
-    This would be triggered by a separate Azure Function
+    Process a message enqueued by enqueue_drives_for_processing
+    Triggered by the delta-processor Azure Function
     """
-    # Example implementation:
-    # notification = json.loads(queue_message)
-    # process_notification_sync(notification)
-    pass 
\ No newline at end of file
+    message_data = orjson.loads(queue_message)
+    process_drive_delta(message_data["drive_id"], message_data.get("tenant_id", "default"))
@@ -5,9 +5,47 @@ This would be triggered by a subscriptionRemoved event
 """
 import os
 import json
-from typing import Dict, Any, List
+import threading
+import time
+import orjson
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List
 from datetime import datetime
 import asyncio
+from telemetry import log_info, log_warning, log_error
+
+# The JSON state files are shared by every cleanup; serialize their
+# read-modify-write cycles so concurrent cleanups don't overwrite each other
+_state_file_lock = threading.Lock()
+
+# Azure Search accepts up to 1000 actions per request; smaller batches keep each one quick
+SEARCH_DELETE_BATCH_SIZE = 100
+
+def _update_json_file(path: str, update: Callable[[Any], bool]) -> bool:
+    """
+    Load a JSON file, let `update` mutate it in place and write it back only if
+    `update` reports a change. The write goes to a temp file that replaces the
+    original, so readers never see a half-written file. Returns whether it changed.
+    """
+    with _state_file_lock:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+        if not update(data):
+            return False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, path)
+        return True
+
+@contextmanager
+def _timed_step(step: Dict[str, Any]):
+    """Record how long a cleanup step ran in step["duration_ms"], on success or failure"""
+    started = time.monotonic()
+    try:
+        yield step
+    finally:
+        step["duration_ms"] = round((time.monotonic() - started) * 1000)
 
 class TenantCleanupManager:
     def __init__(self):
@@ -22,8 +60,8 @@ class TenantCleanupManager:
         Complete tenant cleanup orchestrator
         Removes all tenant data and resources
         """
-        print(f"Starting complete cleanup for tenant {tenant_id}")
-        print(f"Cleanup reason: {reason}")
+        log_info("Starting complete cleanup for tenant %s (reason: %s)", tenant_id, reason,
+                 tenant_id=tenant_id, reason=reason)
         
         result = {
             "tenant_id": tenant_id,
@@ -34,35 +72,45 @@ class TenantCleanupManager:
         }
         
         try:
-            # Step 1: Remove webhook subscriptions
-            await self._remove_webhook_subscriptions(tenant_id, result)
-            
-            # Step 2: Delete search documents
-            await self._delete_search_documents(tenant_id, result)
-            
-            # Step 3: Remove Key Vault secrets
-            await self._remove_keyvault_secrets(tenant_id, result)
-            
-            # Step 4: Clean up tenant configuration
+            # Steps 1-3 (webhooks, search documents, Key Vault secrets) don't
+            # depend on each other, so run them side by side
+            outcomes = await asyncio.gather(
+                self._remove_webhook_subscriptions(tenant_id, result),
+                self._delete_search_documents(tenant_id, result),
+                self._remove_keyvault_secrets(tenant_id, result),
+                return_exceptions=True
+            )
+
+            # Only the critical steps raise; keep the tenant config if one failed
+            # so the cleanup can be retried
+            for outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    raise outcome
+
+            # Step 4: Clean up tenant configuration (last - it removes the tenant identity)
             await self._remove_tenant_config(tenant_id, result)
-            
+
             # Step 5: Log cleanup completion
             await self._log_cleanup_completion(tenant_id, result)
-            
-            result["status"] = "completed"
+
+            # Non-critical steps record their failure instead of raising
+            if any(step.get("status") == "failed" for step in result["steps"]):
+                result["status"] = "partial"
+            else:
+                result["status"] = "completed"
             result["completed"] = datetime.now().isoformat()
             
         except Exception as e:
             result["status"] = "failed"
             result["error"] = str(e)
             result["failed"] = datetime.now().isoformat()
-            print(f"Tenant cleanup failed for {tenant_id}: {e}")
+            log_error("Tenant cleanup failed", e, tenant_id=tenant_id)
         
         return result
     
     async def _remove_webhook_subscriptions(self, tenant_id: str, result: Dict[str, Any]):
         """Remove all webhook subscriptions for the tenant"""
-        print(f"Removing webhook subscriptions for tenant {tenant_id}")
+        log_info("Removing webhook subscriptions for tenant %s", tenant_id, tenant_id=tenant_id, step="remove_webhooks")
         
         step = {
             "step": "remove_webhooks",
@@ -70,30 +118,33 @@ class TenantCleanupManager:
         }
         
         try:
-            # Get all webhook subscriptions for tenant
-            subscriptions = await self._get_tenant_webhooks(tenant_id)
-            
-            removed_count = 0
-            for subscription in subscriptions:
-                await self._delete_webhook_subscription(subscription["id"])
-                removed_count += 1
+            with _timed_step(step):
+                # Get all webhook subscriptions for tenant
+                subscriptions = await self._get_tenant_webhooks(tenant_id)
+                
+                removed_count = 0
+                for subscription in subscriptions:
+                    await self._delete_webhook_subscription(subscription["id"])
+                    removed_count += 1
             
             step["status"] = "completed"
             step["completed"] = datetime.now().isoformat()
             step["subscriptions_removed"] = removed_count
-            print(f"  ✓ Removed {removed_count} webhook subscriptions")
+            log_info("  ✓ Removed %d webhook subscriptions", removed_count,
+                     tenant_id=tenant_id, step="remove_webhooks", status="completed")
             
         except Exception as e:
             step["status"] = "failed"
             step["error"] = str(e)
-            print(f"  ✗ Failed to remove webhook subscriptions: {e}")
+            log_error("  ✗ Failed to remove webhook subscriptions", e,
+                      tenant_id=tenant_id, step="remove_webhooks", status="failed")
             raise
         
         result["steps"].append(step)
     
     async def _delete_search_documents(self, tenant_id: str, result: Dict[str, Any]):
         """Delete all search documents for the tenant"""
-        print(f"Deleting search documents for tenant {tenant_id}")
+        log_info("Deleting search documents for tenant %s", tenant_id, tenant_id=tenant_id, step="delete_search_documents")
         
         step = {
             "step": "delete_search_documents",
@@ -101,31 +152,29 @@ class TenantCleanupManager:
         }
         
         try:
-            # Find all documents for tenant
-            documents = await self._find_tenant_documents(tenant_id)
-            
-            if documents:
-                deleted_count = await self._batch_delete_documents(documents)
-                step["documents_deleted"] = deleted_count
-                print(f"  ✓ Deleted {deleted_count} search documents")
-            else:
-                step["documents_deleted"] = 0
-                print(f"  ✓ No search documents found")
+            with _timed_step(step):
+                # Find all documents for tenant
+                documents = await self._find_tenant_documents(tenant_id)
+                deleted_count = await self._batch_delete_documents(documents) if documents else 0
             
+            step["documents_deleted"] = deleted_count
             step["status"] = "completed"
             step["completed"] = datetime.now().isoformat()
+            log_info("  ✓ Deleted %d search documents", deleted_count,
+                     tenant_id=tenant_id, step="delete_search_documents", status="completed")
             
         except Exception as e:
             step["status"] = "failed"
             step["error"] = str(e)
-            print(f"  ✗ Failed to delete search documents: {e}")
+            log_error("  ✗ Failed to delete search documents", e,
+                      tenant_id=tenant_id, step="delete_search_documents", status="failed")
             raise
         
         result["steps"].append(step)
     
     async def _remove_keyvault_secrets(self, tenant_id: str, result: Dict[str, Any]):
         """Remove tenant-specific secrets from Key Vault"""
-        print(f"Removing Key Vault secrets for tenant {tenant_id}")
+        log_info("Removing Key Vault secrets for tenant %s", tenant_id, tenant_id=tenant_id, step="remove_keyvault_secrets")
         
         step = {
             "step": "remove_keyvault_secrets",
@@ -133,30 +182,38 @@ class TenantCleanupManager:
         }
         
         try:
-            # Find tenant-specific secrets
-            secret_names = await self._find_tenant_secrets(tenant_id)
-            
-            removed_count = 0
-            for secret_name in secret_names:
-                await self._delete_keyvault_secret(secret_name)
-                removed_count += 1
+            with _timed_step(step):
+                # Find tenant-specific secrets
+                secret_names = await self._find_tenant_secrets(tenant_id)
+                
+                # Secrets are independent, so delete them all at once rather than one by one
+                results = await asyncio.gather(
+                    *(self._delete_keyvault_secret(secret_name) for secret_name in secret_names),
+                    return_exceptions=True
+                )
+            errors = [r for r in results if isinstance(r, Exception)]
+            removed_count = len(results) - len(errors)
+            step["secrets_removed"] = removed_count
+            if errors:
+                raise errors[0]
             
             step["status"] = "completed"
             step["completed"] = datetime.now().isoformat()
-            step["secrets_removed"] = removed_count
-            print(f"  ✓ Removed {removed_count} Key Vault secrets")
+            log_info("  ✓ Removed %d Key Vault secrets", removed_count,
+                     tenant_id=tenant_id, step="remove_keyvault_secrets", status="completed")
             
         except Exception as e:
             step["status"] = "failed"
             step["error"] = str(e)
-            print(f"  ✗ Failed to remove Key Vault secrets: {e}")
+            log_warning("  ✗ Failed to remove Key Vault secrets: %s", e,
+                        tenant_id=tenant_id, step="remove_keyvault_secrets", status="failed")
             # Don't raise - this is not critical
         
         result["steps"].append(step)
     
     async def _remove_tenant_config(self, tenant_id: str, result: Dict[str, Any]):
         """Remove tenant configuration from database"""
-        print(f"Removing tenant configuration for {tenant_id}")
+        log_info("Removing tenant configuration for %s", tenant_id, tenant_id=tenant_id, step="remove_tenant_config")
         
         step = {
             "step": "remove_tenant_config",
@@ -164,20 +221,23 @@ class TenantCleanupManager:
         }
         
         try:
-            # Remove from tenant settings
-            await self._delete_tenant_settings(tenant_id)
-            
-            # Remove from webhook subscriptions
-            await self._delete_tenant_webhooks(tenant_id)
+            with _timed_step(step):
+                # Remove from tenant settings
+                await self._delete_tenant_settings(tenant_id)
+                
+                # Remove from webhook subscriptions
+                await self._delete_tenant_webhooks(tenant_id)
             
             step["status"] = "completed"
             step["completed"] = datetime.now().isoformat()
-            print(f"  ✓ Removed tenant configuration")
+            log_info("  ✓ Removed tenant configuration",
+                     tenant_id=tenant_id, step="remove_tenant_config", status="completed")
             
         except Exception as e:
             step["status"] = "failed"
             step["error"] = str(e)
-            print(f"  ✗ Failed to remove tenant configuration: {e}")
+            log_error("  ✗ Failed to remove tenant configuration", e,
+                      tenant_id=tenant_id, step="remove_tenant_config", status="failed")
             raise
         
         result["steps"].append(step)
@@ -229,25 +289,37 @@ class TenantCleanupManager:
         return [f"{tenant_id}_doc_{i}_{random.randint(1000, 9999)}" for i in range(doc_count)]
     
     async def _batch_delete_documents(self, document_ids: List[str]) -> int:
-        """Delete documents in batches"""
-        # Production implementation would batch delete from Azure Search
-        """
-        batch_size = 100
-        deleted_count = 0
-        
-        for i in range(0, len(document_ids), batch_size):
-            batch = document_ids[i:i + batch_size]
-            delete_batch = [{"@search.action": "delete", "id": doc_id} for doc_id in batch]
-            
-            result = self.search_client.upload_documents(delete_batch)
-            for item in result:
-                if item.succeeded:
-                    deleted_count += 1
+        """Delete documents in batches, sending the batches concurrently; returns how many were deleted"""
+        batches = [
+            document_ids[i:i + SEARCH_DELETE_BATCH_SIZE]
+            for i in range(0, len(document_ids), SEARCH_DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(
+            *(self._delete_document_batch(batch) for batch in batches),
+            return_exceptions=True
+        )
         
+        deleted_count = 0
+        for batch_result in results:
+            if isinstance(batch_result, Exception):
+                log_warning("  ✗ Batch delete failed: %s", batch_result, step="delete_search_documents")
+                continue
+            deleted_count += batch_result
         return deleted_count
+    
+    async def _delete_document_batch(self, document_ids: List[str]) -> int:
+        """Delete one batch of documents from the search index; returns how many were deleted"""
+        # Production implementation would batch delete from Azure Search; the
+        # SDK client is blocking, so each batch runs in a thread
+        """
+        results = await asyncio.to_thread(
+            self.search_client.delete_documents,
+            documents=[{"id": doc_id} for doc_id in document_ids]
+        )
+        return sum(1 for item in results if item.succeeded)
         """
         
-        await asyncio.sleep(2)  # Simulate batch deletion
+        await asyncio.sleep(0.2)  # Simulate API call
         return len(document_ids)
     
     async def _find_tenant_secrets(self, tenant_id: str) -> List[str]:
@@ -282,35 +354,30 @@ class TenantCleanupManager:
     
     async def _delete_tenant_settings(self, tenant_id: str):
         """Remove tenant from settings file"""
+        def remove_tenant(all_settings):
+            return all_settings.pop(tenant_id, None) is not None
+        
         try:
-            with open("tenant_settings.json", "r") as f:
-                all_settings = json.load(f)
-            
-            if tenant_id in all_settings:
-                del all_settings[tenant_id]
-                
-                with open("tenant_settings.json", "w") as f:
-                    json.dump(all_settings, f, indent=2)
+            await asyncio.to_thread(_update_json_file, "tenant_settings.json", remove_tenant)
         except Exception as e:
-            print(f"Error removing tenant settings: {e}")
+            log_warning("Error removing tenant settings: %s", e, tenant_id=tenant_id)
     
     async def _delete_tenant_webhooks(self, tenant_id: str):
         """Remove tenant webhooks from subscriptions file"""
-        try:
-            with open("webhook_subscriptions.json", "r") as f:
-                data = json.load(f)
-            
+        def remove_tenant_webhooks(data):
             # Filter out tenant webhooks
-            data["subscriptions"] = [
-                sub for sub in data.get("subscriptions", [])
-                if sub.get("tenantId") != tenant_id
-            ]
+            subscriptions = data.get("subscriptions", [])
+            remaining = [sub for sub in subscriptions if sub.get("tenantId") != tenant_id]
+            if len(remaining) == len(subscriptions):
+                return False  # nothing to remove, leave the file alone
+            data["subscriptions"] = remaining
             data["lastUpdated"] = datetime.now().isoformat() + "Z"
-            
-            with open("webhook_subscriptions.json", "w") as f:
-                json.dump(data, f, indent=2)
+            return True
+        
+        try:
+            await asyncio.to_thread(_update_json_file, "webhook_subscriptions.json", remove_tenant_webhooks)
         except Exception as e:
-            print(f"Error removing tenant webhooks: {e}")
+            log_warning("Error removing tenant webhooks: %s", e, tenant_id=tenant_id)
     
     async def _log_cleanup_completion(self, tenant_id: str, result: Dict[str, Any]):
         """Log tenant cleanup completion"""
@@ -326,7 +393,8 @@ class TenantCleanupManager:
             }
         )
         """
-        print(f"Logged tenant cleanup completion for {tenant_id}")
+        log_info("Logged tenant cleanup completion for %s", tenant_id,
+                 tenant_id=tenant_id, reason=result["reason"], status=result["status"])
 
 # Global instance
 cleanup_manager = TenantCleanupManager()
@@ -1,4 +1,8 @@
 import os
+import sys
+import json
+import hashlib
+from pathlib import Path
 from dotenv import load_dotenv
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
@@ -19,6 +23,9 @@ endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
 key = os.getenv("AZURE_SEARCH_API_KEY")
 index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")
 
+# Hash of the last index definition successfully applied
+INDEX_HASH_FILE = Path(__file__).with_name(".index_hash")
+
 credential = AzureKeyCredential(key)
 index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
 
@@ -57,9 +64,20 @@ index = SearchIndex(
     vector_search=vector_search
 )
 
-try:
-    result = index_client.create_or_update_index(index)
-    print(f"✅ Index '{index_name}' created/updated successfully!")
-    print(f"Index has {len(result.fields)} fields")
-except Exception as e:
-    print(f"❌ Error creating index: {e}") 
\ No newline at end of file
+# Skip the round-trip when this exact definition was already applied to this
+# service; pass --force to push it anyway (e.g. after deleting the index)
+spec_hash = hashlib.sha256(
+    json.dumps({"endpoint": endpoint, "index": index.as_dict()}, sort_keys=True).encode("utf-8")
+).hexdigest()
+
+if "--force" not in sys.argv and INDEX_HASH_FILE.exists() and INDEX_HASH_FILE.read_text().strip() == spec_hash:
+    print(f"✅ Index '{index_name}' is unchanged since the last run, skipping")
+else:
+    try:
+        result = index_client.create_or_update_index(index)
+        INDEX_HASH_FILE.write_text(spec_hash)
+        print(f"✅ Index '{index_name}' created/updated successfully!")
+        print(f"Index has {len(result.fields)} fields")
+    except Exception as e:
+        print(f"❌ Error creating index: {e}")
+ 
\ No newline at end of file
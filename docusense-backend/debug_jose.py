@@ -2,6 +2,8 @@
 
 import requests
 import json
+import re
+import time
 from jose import jwt, jwk
 from jose.backends import RSAKey
 from graph_client import graph_client
@@ -12,6 +14,48 @@ load_dotenv()
 
 TENANT_ID = os.getenv("AAD_TENANT_ID")
 
+# One keep-alive connection to login.microsoftonline.com for every JWKS fetch
+_session = requests.Session()
+
+# Signing keys rotate rarely; keep each tenant's JWKS for the max-age the
+# endpoint advertises (or an hour) and only refetch early on a kid miss
+JWKS_DEFAULT_TTL = 3600  # seconds
+_jwks_cache = {}  # tenant_id -> (expires_at, jwks_data)
+
+def _fetch_jwks(tenant_id: str, force_refresh: bool = False) -> dict:
+    """Return the tenant's JWKS, from the cache unless it expired or force_refresh is set"""
+    cached = _jwks_cache.get(tenant_id)
+    if cached and not force_refresh and cached[0] > time.monotonic():
+        return cached[1]
+    
+    jwks_url = f"https://login.microsoftonline.com/{tenant_id}/discovery/keys"
+    print(f"\n🔍 Fetching JWKS from: {jwks_url}")
+    response = _session.get(jwks_url)
+    response.raise_for_status()
+    jwks_data = response.json()
+    
+    max_age = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    ttl = int(max_age.group(1)) if max_age else JWKS_DEFAULT_TTL
+    _jwks_cache[tenant_id] = (time.monotonic() + ttl, jwks_data)
+    return jwks_data
+
+def _find_key(jwks_data: dict, kid: str):
+    for key_data in jwks_data.get('keys', []):
+        if key_data.get('kid') == kid:
+            return key_data
+    return None
+
+# A kid always names the same key material, so a constructed key never goes
+# stale; build each one once instead of on every verification
+_key_cache = {}  # kid -> constructed jose key
+
+def _construct_key(key_data: dict):
+    kid = key_data.get('kid')
+    key = _key_cache.get(kid)
+    if key is None:
+        key = _key_cache[kid] = jwk.construct(key_data)
+    return key
+
 def debug_jose_verification():
     """Debug jose JWT verification step by step"""
     print("🔍 Debugging Jose JWT Verification...")
@@ -31,23 +75,17 @@ def debug_jose_verification():
     print(f"🔍 Token Issuer: {claims.get('iss')}")
     print(f"🔍 Token Audience: {claims.get('aud')}")
     
-    # Fetch JWKS
-    jwks_url = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/keys"
-    print(f"\n🔍 Fetching JWKS from: {jwks_url}")
-    
     try:
-        response = requests.get(jwks_url)
-        response.raise_for_status()
-        jwks_data = response.json()
+        jwks_data = _fetch_jwks(TENANT_ID)
         
         print(f"✅ JWKS fetched: {len(jwks_data.get('keys', []))} keys")
         
-        # Find the specific key for our token
-        target_key = None
-        for key_data in jwks_data.get('keys', []):
-            if key_data.get('kid') == kid:
-                target_key = key_data
-                break
+        # Find the specific key for our token; an unknown kid may mean the keys
+        # rotated since they were cached, so refetch once before giving up
+        target_key = _find_key(jwks_data, kid)
+        if not target_key:
+            jwks_data = _fetch_jwks(TENANT_ID, force_refresh=True)
+            target_key = _find_key(jwks_data, kid)
         
         if not target_key:
             print(f"❌ Key with kid '{kid}' not found in JWKS")
@@ -95,8 +133,8 @@ def debug_jose_verification():
         # Approach 3: Construct RSA key manually
         print(f"\n3️⃣ Testing with manual RSA key construction...")
         try:
-            # Create RSA key from JWK
-            rsa_key = jwk.construct(target_key)
+            # Create RSA key from JWK (cached per kid)
+            rsa_key = _construct_key(target_key)
             decoded = jwt.decode(
                 token,
                 rsa_key,
@@ -11,6 +11,9 @@ load_dotenv()
 
 TENANT_ID = os.getenv("AAD_TENANT_ID")
 
+# One keep-alive connection to login.microsoftonline.com for every JWKS fetch
+_session = requests.Session()
+
 def debug_jwks_and_token():
     """Debug JWKS keys and token header"""
     print("🔍 Debugging JWKS and Token...")
@@ -40,7 +43,7 @@ def debug_jwks_and_token():
     
     print(f"\n🔍 Fetching JWKS from v1.0 endpoint: {v1_url}")
     try:
-        response = requests.get(v1_url)
+        response = _session.get(v1_url)
         response.raise_for_status()
         v1_jwks = response.json()
         print(f"✅ v1.0 JWKS: {len(v1_jwks.get('keys', []))} keys")
@@ -55,7 +58,7 @@ def debug_jwks_and_token():
     
     print(f"\n🔍 Fetching JWKS from v2.0 endpoint: {v2_url}")
     try:
-        response = requests.get(v2_url)
+        response = _session.get(v2_url)
         response.raise_for_status()
         v2_jwks = response.json()
         print(f"✅ v2.0 JWKS: {len(v2_jwks.get('keys', []))} keys")
@@ -5,26 +5,20 @@ Minimizes manual intervention by using Azure CLI for all operations.
 """
 
 import os
+import shutil
 import json
+import shlex
 import subprocess
 import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from dotenv import load_dotenv
 
-# Load environment variables from .env file
-def load_env_file():
-    """Load environment variables from .env file."""
-    env_file = Path(".env")
-    if env_file.exists():
-        with open(env_file, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    os.environ[key.strip()] = value.strip().strip('"').strip("'")
-
-# Load environment variables
-load_env_file()
+# Load environment variables from the .env file in the working directory;
+# like the old hand-rolled parser, its values win over the environment
+load_dotenv(".env", override=True)
 
 # Configuration
 RESOURCE_GROUP = "docusense-rg"
@@ -45,9 +39,17 @@ REQUIRED_ENV_VARS = [
 ]
 
 def run_command(cmd, check=True, capture_output=True):
-    """Run a command and return the result."""
-    print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True, capture_output=capture_output, text=True)
+    """
+    Run a command and return the result. `cmd` is a shell string, or an argv
+    list to run without a shell (so arguments such as paths need no quoting).
+    """
+    if isinstance(cmd, str):
+        print(f"Running: {cmd}")
+        result = subprocess.run(cmd, shell=True, capture_output=capture_output, text=True)
+    else:
+        cmd = [shutil.which(cmd[0]) or cmd[0], *cmd[1:]]  # finds az.cmd on Windows without a shell
+        print(f"Running: {shlex.join(cmd)}")
+        result = subprocess.run(cmd, capture_output=capture_output, text=True)
     if check and result.returncode != 0:
         print(f"Error running command: {cmd}")
         print(f"Error output: {result.stderr}")
@@ -58,13 +60,11 @@ def check_prerequisites():
     """Check that all prerequisites are met."""
     print("🔍 Checking prerequisites...")
     
-    # Check Azure CLI
-    try:
-        run_command("az --version")
-        print("✅ Azure CLI is installed")
-    except:
+    # Check Azure CLI (a PATH lookup, rather than paying for a separate az --version run)
+    if not shutil.which("az"):
         print("❌ Azure CLI not found. Please install it first.")
         sys.exit(1)
+    print("✅ Azure CLI is installed")
     
     # Check if logged in
     result = run_command("az account show", check=False)
@@ -152,9 +152,7 @@ def configure_function_app():
     print("🔧 Configuring Function App settings...")
     
     # Prepare app settings
-    settings = []
-    for var in REQUIRED_ENV_VARS:
-        settings.extend(["--settings", f"{var}={os.getenv(var)}"])
+    settings = {var: os.getenv(var, "") for var in REQUIRED_ENV_VARS}
     
     # Add additional settings
     additional_settings = {
@@ -165,11 +163,22 @@ def configure_function_app():
         "WEBHOOK_CLIENT_STATE": "docusense-webhook-secret"
     }
     
-    for key, value in additional_settings.items():
-        settings.extend(["--settings", f"{key}={value}"])
+    settings.update(additional_settings)
     
-    cmd = f"az functionapp config appsettings set --name {FUNCTION_APP_NAME} --resource-group {RESOURCE_GROUP} " + " ".join(settings)
-    run_command(cmd)
+    # Hand az all settings as one @file: a single call however many there are,
+    # and no secrets on the command line. mkstemp makes it owner-only.
+    fd, settings_path = tempfile.mkstemp(prefix="docusense-appsettings-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump([{"name": key, "value": value, "slotSetting": False} for key, value in settings.items()], f)
+        run_command([
+            "az", "functionapp", "config", "appsettings", "set",
+            "--name", FUNCTION_APP_NAME,
+            "--resource-group", RESOURCE_GROUP,
+            "--settings", f"@{settings_path}",
+        ])
+    finally:
+        os.unlink(settings_path)
     print("✅ Function App configured")
 
 def create_function_files():
@@ -274,10 +283,8 @@ def deploy_functions():
     """Deploy the functions to Azure."""
     print("🚀 Deploying functions...")
     
-    # Create deployment package
-    os.chdir("webhook_function")
-    run_command("zip -r ../function_app.zip .")
-    os.chdir("..")
+    # Create deployment package (stdlib zipfile: no zip binary, no chdir)
+    shutil.make_archive("function_app", "zip", root_dir="webhook_function")
     
     # Deploy to Azure
     run_command(f"""az functionapp deployment source config-zip \\
@@ -334,8 +341,6 @@ def cleanup_temp_files():
     """Clean up temporary files."""
     print("🧹 Cleaning up temporary files...")
     
-    import shutil
-    
     # Remove temp directories and files
     if os.path.exists("webhook_function"):
         shutil.rmtree("webhook_function")
@@ -352,8 +357,15 @@ def main():
     try:
         check_prerequisites()
         create_resource_group()
-        create_storage_account()
-        create_app_service_plan()
+        
+        # The storage account and the plan only depend on the resource group,
+        # so create them side by side; result() re-raises any failure
+        # (including run_command's SystemExit) here in the main thread
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pending = [executor.submit(create_storage_account), executor.submit(create_app_service_plan)]
+            for future in pending:
+                future.result()
+        
         create_function_app()
         configure_function_app()
         create_function_files()
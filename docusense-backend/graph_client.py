@@ -2,13 +2,25 @@ import os
 import msal
 import requests
 import tempfile
-from typing import List, Dict, Optional
+import threading
+import time
+from typing import BinaryIO, List, Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Refresh the app token this long before it expires, so in-flight calls never carry a stale one
+TOKEN_REFRESH_MARGIN = 300  # seconds
+
+# Downloads up to this size stay in memory; larger ones spill to a temp file
+DOWNLOAD_MEMORY_MAX_BYTES = 8 * 1024 * 1024
+
 class GraphClient:
     def __init__(self):
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        
         self.client_id = os.getenv("AAD_CLIENT_ID")
         self.tenant_id = os.getenv("AAD_TENANT_ID")
         self.client_secret = os.getenv("AAD_CLIENT_SECRET")
@@ -26,10 +38,24 @@ class GraphClient:
         
         self.scope = ["https://graph.microsoft.com/.default"]
         self.graph_url = "https://graph.microsoft.com/v1.0"
-        self._token = None
     
-    def get_token(self) -> Optional[str]:
-        """Get access token for Microsoft Graph API"""
+    def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        """
+        Get access token for Microsoft Graph API.
+        
+        The token is reused until TOKEN_REFRESH_MARGIN before it expires; pass
+        force_refresh=True to request a new one regardless.
+        """
+        if not force_refresh and self._token and time.time() < self._token_expires_at:
+            return self._token
+        
+        with self._token_lock:
+            # Another thread may have refreshed it while we waited
+            if not force_refresh and self._token and time.time() < self._token_expires_at:
+                return self._token
+            return self._acquire_token()
+    
+    def _acquire_token(self) -> Optional[str]:
         try:
             # Remove any cached app tokens to force MSAL to request a new one
             try:
@@ -42,6 +68,7 @@ class GraphClient:
             
             if "access_token" in result:
                 self._token = result["access_token"]
+                self._token_expires_at = time.time() + int(result.get("expires_in", 3600)) - TOKEN_REFRESH_MARGIN
                 return self._token
             else:
                 print(f"❌ Failed to acquire token: {result.get('error_description', 'Unknown error')}")
@@ -215,6 +242,36 @@ class GraphClient:
             print(f"❌ Error downloading file {item_id}: {e}")
             return None
     
+    def download_file_spooled(self, drive_id: str, item_id: str,
+                              max_memory: int = DOWNLOAD_MEMORY_MAX_BYTES) -> Optional[BinaryIO]:
+        """
+        Download a file into a SpooledTemporaryFile, rewound and ready to read.
+        It is held in memory up to `max_memory` bytes and only spills to disk
+        beyond that; closing it releases the buffer or deletes the file.
+        """
+        try:
+            headers = self.get_headers()
+            
+            download_url = f"{self.graph_url}/drives/{drive_id}/items/{item_id}/content"
+            with requests.get(download_url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                
+                buffer = tempfile.SpooledTemporaryFile(max_size=max_memory)
+                try:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            buffer.write(chunk)
+                except Exception:
+                    buffer.close()
+                    raise
+            
+            buffer.seek(0)
+            return buffer
+            
+        except Exception as e:
+            print(f"❌ Error downloading file {item_id}: {e}")
+            return None
+    
     def get_file_info(self, drive_id: str, item_id: str) -> Optional[Dict]:
         """Get detailed information about a file"""
         try:
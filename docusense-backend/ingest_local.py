@@ -1,61 +1,144 @@
-import os, uuid, glob
+import os, re, hashlib
+from functools import lru_cache
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
 import fitz  # PyMuPDF
 from docx import Document
 from pptx import Presentation
 from dotenv import load_dotenv
-from azure.search.documents import SearchClient
+from azure.search.documents import SearchClient, SearchIndexingBufferedSender
 from azure.core.credentials import AzureKeyCredential
-from embedding import embed_text
+from embedding import embed_texts
 
 load_dotenv()
 
-search = SearchClient(
-    endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-    index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
-    credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
-)
+# Documents per indexing request; each chunk carries a 1536-float vector, so
+# this keeps requests well under Azure Search's 16 MB limit
+UPLOAD_BATCH_SIZE = 256
 
-def extract_text(path: str) -> str:
-    """Extract text from various document formats"""
-    ext = os.path.splitext(path)[1].lower()
+def _report_failed_upload(action):
+    print(f"❌ Failed to upload chunk {action.additional_properties.get('id')}")
+
+def _chunk_id(title: str, chunk_idx: int) -> str:
+    """Document id for a chunk; derived from the file and position, so a re-ingest overwrites it"""
+    return hashlib.sha1(f"{title}|{chunk_idx}".encode("utf-8")).hexdigest()
+
+def _delete_stale_chunks(search_client: SearchClient, sender: SearchIndexingBufferedSender, title: str, chunk_count: int):
+    """
+    Delete every document of `title` other than the `chunk_count` chunks just
+    uploaded: chunks left over from an earlier, longer version of the file, and
+    copies indexed under the random ids used before ids were made deterministic
+    """
+    current = {_chunk_id(title, chunk_idx) for chunk_idx in range(chunk_count)}
+    escaped_title = title.replace("'", "''")
+    results = search_client.search(
+        search_text=None,
+        filter=f"title eq '{escaped_title}'",
+        select=["id"]
+    )
+    stale = [{"id": doc["id"]} for doc in results if doc["id"] not in current]
+    if stale:
+        sender.delete_documents(documents=stale)
+        print(f"🗑️  Removing {len(stale)} stale chunks of {title}")
+
+# Extensions iter_text/extract_text understand
+SUPPORTED_EXTENSIONS = frozenset({".pdf", ".docx", ".pptx", ".txt"})
+
+# How extract_text glues the pieces from iter_text back together
+_PIECE_SEPARATORS = {".pdf": " ", ".txt": ""}
+
+def iter_text(path: Union[str, BinaryIO], file_name: Optional[str] = None) -> Iterator[str]:
+    """
+    Yield a document's text piece by piece (per PDF page, DOCX paragraph,
+    PPTX shape or text line), so it can be chunked without ever holding the
+    whole text in memory. Takes the same arguments as extract_text; errors
+    are raised to the caller.
+    """
+    ext = os.path.splitext(file_name or path)[1].lower()
+    
+    if ext == ".pdf":
+        pdf = fitz.open(path) if isinstance(path, str) else fitz.open(stream=path.read(), filetype="pdf")
+        with pdf:
+            for page in pdf:
+                yield page.get_text()
+    
+    elif ext == ".docx":
+        for p in Document(path).paragraphs:
+            yield p.text
+    
+    elif ext == ".pptx":
+        for slide in Presentation(path).slides:
+            for shape in slide.shapes:
+                if shape.has_text_frame:
+                    yield shape.text_frame.text
+    
+    elif ext == ".txt":
+        if not isinstance(path, str):
+            yield path.read().decode('utf-8')
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from f
+    
+    else:
+        print(f"⚠️  Unsupported file type: {ext}")
+
+def extract_text(path: Union[str, BinaryIO], file_name: Optional[str] = None) -> str:
+    """
+    Extract text from various document formats
+    `path` may also be a binary file object, in which case pass `file_name`
+    so the format can be told from its extension.
+    """
+    ext = os.path.splitext(file_name or path)[1].lower()
     
     try:
-        if ext == ".pdf":
-            pdf = fitz.open(path)
-            return " ".join([page.get_text() for page in pdf])
-        
-        elif ext == ".docx":
-            doc = Document(path)
-            return "\n".join([p.text for p in doc.paragraphs])
-        
-        elif ext == ".pptx":
-            prs = Presentation(path)
-            text_parts = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text_parts.append(shape.text)
-            return "\n".join(text_parts)
-        
-        elif ext == ".txt":
-            with open(path, 'r', encoding='utf-8') as f:
-                return f.read()
-        
-        else:
-            print(f"⚠️  Unsupported file type: {ext}")
-            return ""
-            
+        return _PIECE_SEPARATORS.get(ext, "\n").join(iter_text(path, file_name))
     except Exception as e:
-        print(f"❌ Error extracting text from {path}: {e}")
+        print(f"❌ Error extracting text from {file_name or path}: {e}")
         return ""
 
-def chunk_text(text: str, size: int = 300):
-    """Split text into chunks of approximately 'size' words"""
-    words = text.split()
-    for i in range(0, len(words), size):
-        chunk_text = " ".join(words[i:i+size])
-        if chunk_text.strip():  # Only yield non-empty chunks
-            yield chunk_text, i // size
+@lru_cache(maxsize=None)
+def _chunk_pattern(size: int):
+    """Match leading whitespace plus the next `size` words; group 1 spans just the words"""
+    return re.compile(r"\s*(\S+(?:\s+\S+){%d})" % (size - 1))
+
+def chunk_text(text: Union[str, Iterable[str]], size: int = 300):
+    """
+    Split text into chunks of approximately 'size' words
+    Chunks are slices of the original text, so its whitespace is kept as is.
+    `text` may also be an iterable of pieces (e.g. from iter_text); words are
+    buffered across pieces, so only about one chunk is held at a time.
+    """
+    pattern = _chunk_pattern(size)
+    pieces = (text,) if isinstance(text, str) else text
+    pending, pending_words, chunk_idx = [], 0, 0
+    for piece in pieces:
+        pending.append(piece)
+        pending_words += len(piece.split())
+        # Only join and scan once a full chunk is buffered, so short pieces
+        # (lines, paragraphs) don't rescan the tail every time
+        if pending_words < size:
+            continue
+        buffer = "\n".join(pending)
+        pos = 0
+        while match := pattern.match(buffer, pos):
+            yield match.group(1), chunk_idx
+            chunk_idx += 1
+            pos = match.end()
+        tail = buffer[pos:]
+        pending, pending_words = [tail], len(tail.split())
+    tail = "\n".join(pending).strip()
+    if tail:
+        yield tail, chunk_idx
+
+def _supported_files(folder_path: str) -> list[str]:
+    """Paths of the files in `folder_path` that extract_text can read"""
+    # DirEntry.is_file() reuses the type readdir already returned, so this
+    # doesn't stat every entry the way glob + os.path.isfile did
+    with os.scandir(folder_path) as entries:
+        return [
+            entry.path for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+        ]
 
 def ingest_documents(folder_path: str = "sample_docs"):
     """Ingest all documents from the specified folder"""
@@ -65,52 +148,66 @@ def ingest_documents(folder_path: str = "sample_docs"):
         print(f"📝 Please add some documents to {folder_path}/ and run again")
         return
     
-    docs = []
     file_count = 0
     chunk_count = 0
     
-    # Process all supported files in the folder
-    for file_path in glob.glob(f"{folder_path}/*"):
-        if os.path.isfile(file_path):
+    search_client = SearchClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
+    )
+    
+    # The buffered sender batches uploads, retries throttled requests with
+    # backoff and flushes whatever is left when the block exits
+    with SearchIndexingBufferedSender(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=os.getenv("AZURE_SEARCH_INDEX_NAME"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY")),
+        initial_batch_action_count=UPLOAD_BATCH_SIZE,
+        on_error=_report_failed_upload
+    ) as sender:
+        # Process all supported files in the folder
+        for file_path in _supported_files(folder_path):
             print(f"📄 Processing: {os.path.basename(file_path)}")
             
-            content = extract_text(file_path)
-            if not content.strip():
-                print(f"⚠️  No text extracted from {file_path}")
-                continue
-                
             title = os.path.basename(file_path)
-            file_count += 1
+            file_chunks = 0
             
-            # Split into chunks and create embeddings
-            for snippet, chunk_idx in chunk_text(content):
+            # Stream the text through the chunker and embed/upload it a group
+            # at a time, so memory stays bounded however large the file is
+            try:
+                chunks = chunk_text(iter_text(file_path))
+                while group := list(islice(chunks, UPLOAD_BATCH_SIZE)):
+                    embeddings = embed_texts([snippet for snippet, _ in group])
+                    # Ids derive from the file and chunk position, so a re-ingest
+                    # updates the existing documents instead of duplicating them
+                    sender.merge_or_upload_documents(documents=[
+                        {
+                            "id": _chunk_id(title, chunk_idx),
+                            "title": title,
+                            "content": snippet,
+                            "chunk": chunk_idx,
+                            "vector": embedding
+                        }
+                        for (snippet, chunk_idx), embedding in zip(group, embeddings)
+                    ])
+                    file_chunks += len(group)
+            except Exception as e:
+                print(f"❌ Error extracting text from {file_path}: {e}")
+            else:
+                # Only once the whole file went through; a partial read must not
+                # delete chunks that are still current
                 try:
-                    embedding = embed_text(snippet)
-                    
-                    doc = {
-                        "id": str(uuid.uuid4()),
-                        "title": title,
-                        "content": snippet,
-                        "chunk": chunk_idx,
-                        "vector": embedding
-                    }
-                    
-                    docs.append(doc)
-                    chunk_count += 1
-                    
-                    # Upload in batches of 100 to avoid timeouts
-                    if len(docs) >= 100:
-                        search.upload_documents(documents=docs)
-                        print(f"📤 Uploaded batch of {len(docs)} chunks")
-                        docs = []
-                        
+                    _delete_stale_chunks(search_client, sender, title, file_chunks)
                 except Exception as e:
-                    print(f"❌ Error processing chunk from {title}: {e}")
-    
-    # Upload remaining documents
-    if docs:
-        search.upload_documents(documents=docs)
-        print(f"📤 Uploaded final batch of {len(docs)} chunks")
+                    print(f"⚠️  Could not remove stale chunks of {title}: {e}")
+            
+            if not file_chunks:
+                print(f"⚠️  No text extracted from {file_path}")
+                continue
+            
+            file_count += 1
+            chunk_count += file_chunks
     
     print(f"✅ Ingestion complete!")
     print(f"📊 Processed {file_count} files, created {chunk_count} chunks")
@@ -1,15 +1,18 @@
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from dotenv import load_dotenv
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from graph_client import graph_client
 from ingest_local import extract_text, chunk_text
-from embedding import embed_text
+from embedding import embed_texts
 
 load_dotenv()
 
+INGEST_WORKERS = 8  # files downloaded and extracted at a time
+
 def get_search_client():
     """Get Azure Search client"""
     return SearchClient(
@@ -18,6 +21,28 @@ def get_search_client():
         credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY"))
     )
 
+def _download_and_chunk(drive_id: str, file_info: Dict):
+    """Download one file and split its text into chunks; returns None if there is nothing to index"""
+    file_name = file_info.get('name', 'Unknown')
+    print(f"📄 Processing: {file_name}")
+    
+    try:
+        download = graph_client.download_file_spooled(drive_id, file_info.get('id'))
+        if not download:
+            print(f"⚠️  Failed to download {file_name}")
+            return None
+        
+        with download:
+            content = extract_text(download, file_name)
+        if not content.strip():
+            print(f"⚠️  No text extracted from {file_name}")
+            return None
+        
+        return list(chunk_text(content))
+    except Exception as e:
+        print(f"❌ Error processing {file_name}: {e}")
+        return None
+
 def ingest_from_onedrive(drive_id: str = None, max_files: int = 10):
     """Ingest documents from OneDrive/SharePoint"""
     print("🔄 Starting OneDrive ingestion...")
@@ -85,32 +110,22 @@ def ingest_from_onedrive(drive_id: str = None, max_files: int = 10):
     docs = []
     total_chunks = 0
     
-    for file_info in files_to_process:
-        file_name = file_info.get('name', 'Unknown')
-        file_id = file_info.get('id')
-        
-        print(f"📄 Processing: {file_name}")
+    # Downloads and extraction run in a thread pool (network-bound, and the
+    # PDF/DOCX parsers are native code); embedding and uploads stay on this
+    # thread and consume files in order as they become ready.
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        prepared = executor.map(lambda file_info: _download_and_chunk(drive_id, file_info), files_to_process)
         
-        try:
-            # Download file to temporary location
-            temp_path = graph_client.download_file(drive_id, file_id)
-            if not temp_path:
-                print(f"⚠️  Failed to download {file_name}")
+        for file_info, chunks in zip(files_to_process, prepared):
+            if not chunks:
                 continue
+            file_name = file_info.get('name', 'Unknown')
             
-            # Extract text from the file
-            content = extract_text(temp_path)
-            if not content.strip():
-                print(f"⚠️  No text extracted from {file_name}")
-                os.unlink(temp_path)  # Clean up temp file
-                continue
-            
-            # Create chunks and embeddings
-            file_chunks = 0
-            for snippet, chunk_idx in chunk_text(content):
-                try:
-                    embedding = embed_text(snippet)
-                    
+            try:
+                # Embed the file's chunks in batched requests rather than one per chunk
+                embeddings = embed_texts([snippet for snippet, _ in chunks])
+                
+                for (snippet, chunk_idx), embedding in zip(chunks, embeddings):
                     doc = {
                         "id": str(uuid.uuid4()),
                         "title": file_name,
@@ -120,7 +135,6 @@ def ingest_from_onedrive(drive_id: str = None, max_files: int = 10):
                     }
                     
                     docs.append(doc)
-                    file_chunks += 1
                     total_chunks += 1
                     
                     # Upload in batches of 50
@@ -128,18 +142,12 @@ def ingest_from_onedrive(drive_id: str = None, max_files: int = 10):
                         search_client.upload_documents(documents=docs)
                         print(f"📤 Uploaded batch of {len(docs)} chunks")
                         docs = []
-                        
-                except Exception as e:
-                    print(f"❌ Error processing chunk from {file_name}: {e}")
-            
-            print(f"✅ {file_name}: {file_chunks} chunks created")
-            
-            # Clean up temporary file
-            os.unlink(temp_path)
-            
-        except Exception as e:
-            print(f"❌ Error processing {file_name}: {e}")
-            continue
+                
+                print(f"✅ {file_name}: {len(chunks)} chunks created")
+                
+            except Exception as e:
+                print(f"❌ Error processing {file_name}: {e}")
+                continue
     
     # Upload remaining documents
     if docs:
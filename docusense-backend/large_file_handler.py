@@ -12,13 +12,14 @@ from datetime import datetime
 import requests
 from graph_client import graph_client
 from ingest_local import extract_text, chunk_text
-from embedding import embed_text
+from embedding import embed_texts
 from azure_search_client import get_search_client
 
 # Configuration
 MAX_STANDARD_FILE_SIZE = 50 * 1024 * 1024  # 50MB - process normally
 MAX_LARGE_FILE_SIZE = 200 * 1024 * 1024    # 200MB - use streaming
 CHUNK_SIZE = 8 * 1024 * 1024               # 8MB chunks for streaming
+REMOVE_BATCH_SIZE = 1000                    # max documents per Azure Search indexing request
 
 def can_process_file_size(file_size: int) -> Tuple[bool, str]:
     """
@@ -140,15 +141,14 @@ def process_text_in_batches(content: str, file_name: str, drive_id: str, item_id
     """
     Generator that yields batches of processed document chunks
     """
-    batch_docs = []
+    # Every chunk of the file shares one ingestion timestamp
+    indexed_at = datetime.utcnow().isoformat()
     
-    for snippet, chunk_idx in chunk_text(content):
-        try:
-            # Generate embedding for this chunk
-            embedding = embed_text(snippet)
-            
-            # Create document
-            doc = {
+    def build_docs(chunks):
+        # One embeddings request for the whole batch rather than one per chunk
+        embeddings = embed_texts([snippet for snippet, _ in chunks])
+        return [
+            {
                 "id": f"{tenant_id}_{drive_id}_{item_id}_{chunk_idx}",
                 "title": file_name,
                 "content": snippet,
@@ -157,24 +157,25 @@ def process_text_in_batches(content: str, file_name: str, drive_id: str, item_id
                 "source_drive_id": drive_id,
                 "source_item_id": item_id,
                 "tenant_id": tenant_id,
-                "last_modified": datetime.utcnow().isoformat(),
+                "last_modified": indexed_at,
                 "file_size_category": "large"  # Mark as large file
             }
-            
-            batch_docs.append(doc)
-            
-            # Yield batch when it reaches the target size
-            if len(batch_docs) >= batch_size:
-                yield batch_docs
-                batch_docs = []
-                
-        except Exception as e:
-            logging.error(f'Error processing chunk {chunk_idx} from {file_name}: {str(e)}')
-            # Continue with other chunks
+            for (snippet, chunk_idx), embedding in zip(chunks, embeddings)
+        ]
+    
+    pending = []
+    
+    for snippet, chunk_idx in chunk_text(content):
+        pending.append((snippet, chunk_idx))
+        
+        # Yield batch when it reaches the target size
+        if len(pending) >= batch_size:
+            yield build_docs(pending)
+            pending = []
     
     # Yield remaining documents
-    if batch_docs:
-        yield batch_docs
+    if pending:
+        yield build_docs(pending)
 
 def remove_file_from_index(drive_id: str, item_id: str, tenant_id: str):
     """Remove all chunks for a file from the search index"""
@@ -185,15 +186,21 @@ def remove_file_from_index(drive_id: str, item_id: str, tenant_id: str):
         # Search for all documents from this file for this tenant
         filter_query = f"source_drive_id eq '{drive_id}' and source_item_id eq '{item_id}' and tenant_id eq '{tenant_id}'"
         
+        # Filter-only query (no text to evaluate or score) returning just the ids
         results = search_client.search(
-            search_text="*",
-            filter=filter_query
+            search_text=None,
+            filter=filter_query,
+            select=["id"]
         )
         
-        # Delete all chunks
+        # Collect every id before deleting, so deletes can't shift the result pages
         doc_ids = [doc["id"] for doc in results]
+        
+        # Delete all chunks, REMOVE_BATCH_SIZE keys per indexing request
+        for start in range(0, len(doc_ids), REMOVE_BATCH_SIZE):
+            batch = doc_ids[start:start + REMOVE_BATCH_SIZE]
+            search_client.delete_documents(documents=[{"id": doc_id} for doc_id in batch])
         if doc_ids:
-            search_client.delete_documents(documents=[{"id": doc_id} for doc_id in doc_ids])
             logging.info(f'Removed {len(doc_ids)} chunks from search index (tenant: {tenant_id})')
             
     except Exception as e:
@@ -1,13 +1,14 @@
+import asyncio
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from azure_search_client import search_docs
-from auth_verified import auth_dependency, lenient_auth_dependency
+from auth_verified import auth_dependency, lenient_auth_dependency, warm_up as warm_up_auth
 from datetime import datetime, timedelta
 import json
 
-app = FastAPI(title="AllFind API", version="1.0.0")
+app = FastAPI(title="AllFind API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Add CORS middleware for development and production
 origins = [
@@ -24,6 +25,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def prefetch_signing_keys():
+    """Warm the JWKS cache in the background so the first authenticated request doesn't pay for it"""
+    asyncio.get_running_loop().run_in_executor(None, warm_up_auth)
+
 class SearchRequest(BaseModel):
     query: str
 
@@ -1,6 +1,7 @@
+import asyncio
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 import json
@@ -10,12 +11,12 @@ import os
 from tenant_settings import get_tenant_settings, update_tenant_settings
 from webhook_manager import get_webhook_subscriptions
 from usage_analytics import get_usage_statistics
-from audit_logger import generate_audit_csv
+from audit_logger import iter_audit_csv
 
 # Import authentication modules
-from auth_verified import auth_dependency, lenient_auth_dependency
+from auth_verified import auth_dependency, lenient_auth_dependency, warm_up as warm_up_auth
 
-app = FastAPI(title="AllFind API", version="1.0.0")
+app = FastAPI(title="AllFind API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Add CORS middleware for development and production
 origins = [
@@ -33,6 +34,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def prefetch_signing_keys():
+    """Warm the JWKS cache in the background so the first authenticated request doesn't pay for it"""
+    asyncio.get_running_loop().run_in_executor(None, warm_up_auth)
+
 class SearchRequest(BaseModel):
     query: str
 
@@ -198,10 +204,8 @@ async def get_audit_log(from_date: str, to_date: str, user_claims=Depends(curren
     tenant_id = get_tenant_id_from_claims(user_claims)
     print(f"Audit log accessed by {user_claims.get('preferred_username', 'unknown')} for tenant {tenant_id}, dates: {from_date} to {to_date}")
     
-    # Generate live audit log CSV
-    csv_content = generate_audit_csv(from_date, to_date, tenant_id)
-    
-    return PlainTextResponse(content=csv_content, media_type="text/csv")
+    # Generate live audit log CSV, streamed in chunks rather than built as one string
+    return StreamingResponse(iter_audit_csv(from_date, to_date, tenant_id), media_type="text/csv")
 
 # Get user info endpoint
 @app.get("/me")
@@ -7,6 +7,7 @@ import os
 import json
 import hmac
 import hashlib
+import time
 import requests
 from typing import List, Dict
 from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
@@ -133,18 +134,28 @@ async def process_drive_delta(drive_id: str):
         print(f"❌ Error processing drive delta: {e}")
 
 # Simple in-memory cache for processed files (production should use Redis/database)
+# (drive_id, item_id) -> (expires_at, last_modified), bounded so a long-lived
+# process doesn't keep one entry per file it has ever seen
+PROCESSED_CACHE_TTL = 24 * 3600  # seconds
+PROCESSED_CACHE_MAX_ENTRIES = 200_000
 processed_files_cache = {}
 
 async def is_already_processed(drive_id: str, item_id: str, last_modified: str) -> bool:
     """Check if file version was already processed (idempotency)"""
-    cache_key = f"{drive_id}_{item_id}"
-    cached_timestamp = processed_files_cache.get(cache_key)
-    return cached_timestamp == last_modified
+    cached = processed_files_cache.get((drive_id, item_id))
+    return cached is not None and cached[0] > time.monotonic() and cached[1] == last_modified
 
 async def mark_as_processed(drive_id: str, item_id: str, last_modified: str):
     """Mark file version as processed"""
-    cache_key = f"{drive_id}_{item_id}"
-    processed_files_cache[cache_key] = last_modified
+    now = time.monotonic()
+    if len(processed_files_cache) >= PROCESSED_CACHE_MAX_ENTRIES:
+        # Drop expired entries; if that isn't enough, drop the oldest half
+        for key in [key for key, (expires_at, _) in processed_files_cache.items() if expires_at <= now]:
+            del processed_files_cache[key]
+        if len(processed_files_cache) >= PROCESSED_CACHE_MAX_ENTRIES:
+            for key in list(processed_files_cache)[:PROCESSED_CACHE_MAX_ENTRIES // 2]:
+                del processed_files_cache[key]
+    processed_files_cache[(drive_id, item_id)] = (now + PROCESSED_CACHE_TTL, last_modified)
 
 async def ingest_single_file(drive_id: str, item_id: str):
     """Ingest a single file that was created or updated"""
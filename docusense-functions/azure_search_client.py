@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
@@ -8,6 +9,10 @@ from embedding import embed_text
 
 load_dotenv()
 
+# Clients are thread-safe and hold their own pooled HTTP session, so build each
+# one once per process instead of on every call. The index is shared by all
+# tenants (documents are scoped by tenant_id filters), so no per-tenant key.
+@lru_cache(maxsize=None)
 def get_search_client():
     endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
     key = os.getenv("AZURE_SEARCH_API_KEY")
@@ -16,6 +21,7 @@ def get_search_client():
     credential = AzureKeyCredential(key)
     return SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
 
+@lru_cache(maxsize=None)
 def get_index_client():
     endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
     key = os.getenv("AZURE_SEARCH_API_KEY")
@@ -59,4 +65,31 @@ def search_docs(query: str, top_k: int = 5):
             "score": result.get("@search.score", 0.0)
         })
     
-    return matches 
\ No newline at end of file
+    return matches
+
+# Azure Search accepts at most 1000 documents and 16 MB per indexing request
+UPLOAD_BATCH_MAX_DOCS = 1000
+UPLOAD_BATCH_MAX_BYTES = 14 * 1024 * 1024  # headroom under the 16 MB limit
+
+def _estimated_json_size(doc) -> int:
+    """Rough upper bound on a chunk document's JSON size; the vector dominates"""
+    return 2 * len(doc.get("content", "")) + 24 * len(doc.get("vector", ())) + 1024
+
+def upload_documents_in_batches(search_client, docs) -> int:
+    """
+    Upload documents in requests that stay under Azure Search's per-request
+    document and size limits. Returns the number of documents uploaded.
+    """
+    batch, batch_bytes, uploaded = [], 0, 0
+    for doc in docs:
+        doc_bytes = _estimated_json_size(doc)
+        if batch and (len(batch) >= UPLOAD_BATCH_MAX_DOCS or batch_bytes + doc_bytes > UPLOAD_BATCH_MAX_BYTES):
+            search_client.upload_documents(documents=batch)
+            uploaded += len(batch)
+            batch, batch_bytes = [], 0
+        batch.append(doc)
+        batch_bytes += doc_bytes
+    if batch:
+        search_client.upload_documents(documents=batch)
+        uploaded += len(batch)
+    return uploaded
@@ -0,0 +1,11 @@
+import azure.functions as func
+import logging
+
+# Shares the delta processing code with the webhook function
+from webhook import process_notification_from_queue
+
+def main(msg: func.ServiceBusMessage) -> None:
+    """Azure Function Service Bus trigger that runs the drive delta queued by the webhook"""
+    
+    logging.info(f'Delta processing message received: {msg.message_id}')
+    process_notification_from_queue(msg.get_body().decode('utf-8'))
@@ -1,25 +1,141 @@
 import os
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 
 load_dotenv()
 
-client = AzureOpenAI(
+# The SDK retries 429s and 5xx itself with exponential backoff (honouring
+# Retry-After); allow a few more attempts than its default of 2 since
+# embed_texts sends several requests at once.
+# Created once and shared by every embed_texts worker thread (its httpx
+# connection pool is thread-safe) - never build a client per call or thread.
+client: Final = AzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    max_retries=5
 )
 
-DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+DEPLOYMENT_NAME: Final = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+EMBEDDING_BATCH_SIZE = 16  # inputs per embeddings request
+EMBEDDING_WORKERS = 4  # concurrent embeddings requests per embed_texts call
 
 def embed_text(text: str) -> list[float]:
+    # Same request (and mock fallback) as a one-item batch, plus the caches
+    return embed_texts([text])[0]
+
+# Optional on-disk cache of embeddings, keyed by a hash of the deployment and
+# input text, so re-ingesting unchanged documents doesn't embed them again.
+# Enabled by pointing EMBEDDING_CACHE_PATH at a SQLite file.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+_cache_db = None
+_cache_lock = threading.Lock()  # embed_texts writes from several threads
+CACHE_LOOKUP_BATCH_SIZE = 500
+
+# Recently used embeddings are also kept in process (always on, LRU-evicted),
+# so repeated snippets within a run skip both the API and SQLite.
+MEMORY_CACHE_SIZE = 4096
+_memory_cache: "OrderedDict[bytes, list[float]]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+def _get_cache_db():
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS emb (h BLOB PRIMARY KEY, v BLOB)")
+    return _cache_db
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.sha256(f"{DEPLOYMENT_NAME}\0{text}".encode("utf-8")).digest()
+
+def _load_remembered(texts: list[str]) -> dict[str, list[float]]:
+    found = {}
+    with _memory_lock:
+        for text in texts:
+            key = _cache_key(text)
+            if key in _memory_cache:
+                _memory_cache.move_to_end(key)
+                found[text] = _memory_cache[key]
+    return found
+
+def _remember(texts: list[str], embeddings: list[list[float]]):
+    with _memory_lock:
+        for text, embedding in zip(texts, embeddings):
+            key = _cache_key(text)
+            _memory_cache[key] = embedding
+            _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+def _load_cached(texts: list[str]) -> dict[str, list[float]]:
+    keys = {_cache_key(text): text for text in texts}
+    hashes = list(keys)
+    found = {}
+    with _cache_lock:
+        db = _get_cache_db()
+        # Look keys up a few hundred at a time (SQLite caps bound parameters)
+        for start in range(0, len(hashes), CACHE_LOOKUP_BATCH_SIZE):
+            batch = hashes[start:start + CACHE_LOOKUP_BATCH_SIZE]
+            rows = db.execute(f"SELECT h, v FROM emb WHERE h IN ({','.join('?' * len(batch))})", batch)
+            for h, v in rows:
+                # float32 blobs unpack straight into the list the callers send on
+                found[keys[h]] = array("f", v).tolist()
+    return found
+
+def _store_cached(texts: list[str], embeddings: list[list[float]]):
+    with _cache_lock:
+        db = _get_cache_db()
+        with db:  # one transaction per batch
+            db.executemany(
+                "INSERT OR REPLACE INTO emb (h, v) VALUES (?, ?)",
+                [(_cache_key(text), array("f", embedding).tobytes()) for text, embedding in zip(texts, embeddings)]
+            )
+
+def _embed_batch(batch: list[str]) -> list[list[float]]:
     try:
         response = client.embeddings.create(
-            input=text,
+            input=batch,
             model=DEPLOYMENT_NAME
         )
-        return response.data[0].embedding
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
     except Exception as e:
         print(f"❌ Azure OpenAI Error: {e}")
         print("⚠️  Falling back to mock embedding")
-        return [0.1] * 1536  # Fallback mock embedding 
\ No newline at end of file
+        return [[0.1] * 1536 for _ in batch]  # Fallback mock embedding (never cached)
+    
+    _remember(batch, embeddings)
+    if EMBEDDING_CACHE_PATH:
+        _store_cached(batch, embeddings)
+    return embeddings
+
+def embed_texts(texts: list[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> list[list[float]]:
+    """
+    Embed many texts, sending up to `batch_size` inputs per request and up to
+    EMBEDDING_WORKERS requests at a time. Results are in input order.
+    Texts embedded recently in this process are not sent again, nor (with
+    EMBEDDING_CACHE_PATH set) are texts embedded by any earlier run.
+    """
+    unique = list(dict.fromkeys(texts))
+    known = _load_remembered(unique)
+    if EMBEDDING_CACHE_PATH:
+        cached = _load_cached([text for text in unique if text not in known])
+        _remember(list(cached), list(cached.values()))
+        known.update(cached)
+    missing = [text for text in unique if text not in known]
+    
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    if len(batches) == 1:
+        known.update(zip(batches[0], _embed_batch(batches[0])))
+    elif batches:
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_WORKERS, len(batches))) as executor:
+            for batch, embeddings in zip(batches, executor.map(_embed_batch, batches)):
+                known.update(zip(batch, embeddings))
+    
+    return [known[text] for text in texts]
@@ -293,9 +293,9 @@ def track_performance(operation_name: str):
     return decorator
 
 # Convenience functions
-def log_info(message: str, **kwargs):
-    """Log info message with optional custom dimensions"""
-    logger.logger.info(message, extra={"custom_dimensions": kwargs} if kwargs else None)
+def log_info(message: str, *args, **kwargs):
+    """Log info message (lazily %-formatted with args) with optional custom dimensions"""
+    logger.logger.info(message, *args, extra={"custom_dimensions": kwargs} if kwargs else None)
 
 def log_error(message: str, error: Optional[Exception] = None, **kwargs):
     """Log error message with optional exception and custom dimensions"""
@@ -305,9 +305,9 @@ def log_error(message: str, error: Optional[Exception] = None, **kwargs):
         exc_info=error
     )
 
-def log_warning(message: str, **kwargs):
-    """Log warning message with optional custom dimensions"""
-    logger.logger.warning(message, extra={"custom_dimensions": kwargs} if kwargs else None)
+def log_warning(message: str, *args, **kwargs):
+    """Log warning message (lazily %-formatted with args) with optional custom dimensions"""
+    logger.logger.warning(message, *args, extra={"custom_dimensions": kwargs} if kwargs else None)
 
 # Health check function
 def health_check() -> Dict[str, Any]:
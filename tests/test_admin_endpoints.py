@@ -236,5 +236,42 @@ class TestLiveDataModules:
         assert "timestamp" in csv_content
         assert "event_type" in csv_content
 
+    def test_audit_logger_csv_round_trip(self):
+        """Test that quoted details survive a round trip through the csv module"""
+        import csv
+        import dataclasses
+        import io
+        from audit_logger import AuditEvent, audit_logger
+
+        events = [AuditEvent(
+            timestamp="2025-06-20T09:00:00",
+            event_type="search",
+            user="jane.smith@contoso.com",
+            details='Query: "budget proposal", Results: 3',
+            result="success",
+            tenant_id="default",
+            session_id="sess_00000001",
+        )]
+
+        rows = list(csv.reader(io.StringIO(audit_logger._events_to_csv(events))))
+        assert rows[0] == ["timestamp", "event_type", "user", "details", "result", "tenant_id", "session_id"]
+        assert rows[1] == list(dataclasses.astuple(events[0]))
+
+    def test_audit_logger_seeded_output_is_reproducible(self):
+        """Test that a seeded audit logger generates the same sample data every time"""
+        from audit_logger import AuditLogger
+
+        first = AuditLogger(seed=42).generate_audit_csv("2025-06-01", "2025-06-30", "default")
+        second = AuditLogger(seed=42).generate_audit_csv("2025-06-01", "2025-06-30", "default")
+        assert first == second
+        assert len(first.splitlines()) > 30  # header plus at least one event per day
+
+    def test_audit_logger_streamed_csv_matches_string(self):
+        """Test that the streamed CSV chunks add up to the same document as the string API"""
+        from audit_logger import AuditLogger
+
+        streamed = b"".join(AuditLogger(seed=42).iter_audit_csv("2025-01-01", "2025-12-31", "default"))
+        assert streamed.decode("utf-8") == AuditLogger(seed=42).generate_audit_csv("2025-01-01", "2025-12-31", "default")
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
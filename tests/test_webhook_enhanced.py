@@ -0,0 +1,58 @@
+"""
+Tests for the enhanced Graph webhook
+Exercises the per-item change handling with the Graph/Search side mocked out
+"""
+import pytest
+import sys
+import os
+from unittest.mock import MagicMock
+
+# Add the backend directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'docusense-backend'))
+
+# The webhook pulls in the Azure Functions runtime and the Graph/Search clients
+pytest.importorskip("azure.functions")
+pytest.importorskip("msal")
+
+import azure_function_webhook_enhanced as webhook
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    """Stub out everything process_single_item_change talks to and return the ingest mock"""
+    ingest = MagicMock(return_value=True)
+    monkeypatch.setattr(webhook, "ingest_file_with_size_handling", ingest)
+    monkeypatch.setattr(webhook, "should_process_file", lambda name, mime, size: (True, "supported"))
+    monkeypatch.setattr(webhook, "log_file_decision", lambda *args: None)
+    monkeypatch.setattr(webhook, "should_use_queue_processing", lambda size: False)
+    monkeypatch.setattr(webhook, "can_process_file_size", lambda size: (True, "streaming"))
+    monkeypatch.setattr(webhook, "get_estimated_processing_cost", lambda size, ext: 0.0)
+    monkeypatch.setattr(webhook, "logger", MagicMock())
+    monkeypatch.setattr(webhook, "processed_files_cache", {})
+    return ingest
+
+
+class TestProcessSingleItemChange:
+    """Test suite for delta item processing"""
+
+    item = {
+        "id": "item-1",
+        "name": "report.pdf",
+        "size": 10 * 1024 * 1024,
+        "lastModifiedDateTime": "2025-06-20T09:00:00Z",
+        "file": {"mimeType": "application/pdf"},
+    }
+
+    def test_supported_file_is_ingested_once(self, ingest):
+        """Test that a 10 MB PDF goes through ingestion exactly once"""
+        webhook.process_single_item_change(self.item, "drive-1", "default")
+        ingest.assert_called_once_with("drive-1", "item-1", "report.pdf", 10 * 1024 * 1024, "default")
+
+    def test_unchanged_file_is_not_reingested(self, ingest):
+        """Test that the idempotency cache skips a version that was already indexed"""
+        webhook.process_single_item_change(self.item, "drive-1", "default")
+        webhook.process_single_item_change(self.item, "drive-1", "default")
+        assert ingest.call_count == 1
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])